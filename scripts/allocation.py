@@ -0,0 +1,48 @@
+import heapq
+from scripts.coordinape_enums import ExclusionMethod
+
+
+# Largest remainder apportionment of amount_to_split by votes, done in integers.
+# Everyone gets floor(amount * votes / total_votes) and the leftover units
+# (always fewer than the number of voters) go to the largest remainders,
+# earliest contributor first on ties, so sum(amounts) == amount_to_split.
+def apportion(votes, amount_to_split, total_votes=None):
+    amount_to_split = int(amount_to_split)
+    if total_votes is None:
+        total_votes = sum(votes)
+    assert total_votes > 0, "Can't apportion without any votes"
+
+    amounts = []
+    remainders = []
+    for vote in votes:
+        amount, remainder = divmod(amount_to_split * vote, total_votes)
+        amounts.append(amount)
+        remainders.append(remainder)
+
+    dust = amount_to_split - sum(amounts)
+    assert 0 <= dust < max(len(votes), 1)
+    if dust:
+        for i in heapq.nlargest(dust, range(len(remainders)), key=remainders.__getitem__):
+            amounts[i] += 1
+
+    return amounts
+
+
+# Splits amount_to_split between the contributors with the given votes.
+# excluded_indices are the positions of excluded contributors in votes.
+# Returns (amounts, kept_indices, removed_amount) where amounts line up with kept_indices.
+def allocate(votes, amount_to_split, excluded_indices=(), exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE):
+    excluded_indices = set(excluded_indices)
+    kept_indices = [i for i in range(len(votes)) if i not in excluded_indices]
+
+    # REMOVE_SHARE means excluded contributors keep their share of the votes,
+    # but their amount is taken out of the pool instead of being sent
+    if exclusion_type == ExclusionMethod.REMOVE_SHARE:
+        all_amounts = apportion(votes, amount_to_split)
+        amounts = [all_amounts[i] for i in kept_indices]
+        removed_amount = sum(all_amounts[i] for i in excluded_indices)
+        return amounts, kept_indices, removed_amount
+
+    # REDISTRIBUTE_SHARE means excluded contributors are treated as never being in the pool
+    amounts = apportion([votes[i] for i in kept_indices], amount_to_split)
+    return amounts, kept_indices, 0
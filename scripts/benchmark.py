@@ -0,0 +1,245 @@
+import argparse
+import json
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from scripts.constants import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
+from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+from scripts.epoch_results_cache import EpochResultsCache
+from scripts.epoch_results_fetcher import EpochResultsFetcher
+from scripts.chain_snapshot import ChainSnapshot
+from scripts.disbursement import Disbursement
+from scripts.report import make_table
+from scripts.cli import OFFLINE_COMMAND_MODULES
+
+# Benchmarks the offline paths (csv parsing/filtering, get_amounts and make_table) on
+# synthetic circles served from a local http server, and compares against saved results:
+# python scripts/benchmark.py --save bench.json
+# python scripts/benchmark.py --compare bench.json --threshold 0.25
+# It also times how long the offline cli commands take to start in a fresh interpreter.
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000]
+COLD_START_BUDGET = 0.5
+# Slowdowns smaller than this are timer noise on the small sizes, whatever the percentage
+MIN_REGRESSION_SECONDS = 0.005
+HEAVY_MODULES = ["brownie", "web3", "pytest", "ape_safe", "numpy"]
+BENCHMARK_GROUP = CoordinapeGroup.COORDINAPETESTING
+BENCHMARK_SAFE_ADDRESS = "0xFEB4acf3df3cDEA7399794D0869ef76A6EfAff52"
+BENCHMARK_STATE = {
+    "block": 0,
+    "safe_address": BENCHMARK_SAFE_ADDRESS,
+    "yfi_decimal_multiplicand": 10 ** 18,
+    "yvyfi_total_assets": 5_000 * 10 ** 18,
+    "yvyfi_total_supply": 4_900 * 10 ** 18,
+    "yvyfi_price_per_share": 1_020_408_163_265_306_122,
+    "yfi_usd_answer": 30_000 * 10 ** 8,
+    "yfi_usd_decimals": 8,
+    "usdc_decimals": 6,
+    "treasury_governance": BENCHMARK_SAFE_ADDRESS,
+    "safe_yvyfi": 10 ** 18,
+    "safe_yfi": 1_000 * 10 ** 18,
+    "safe_usdc": 0,
+    "treasury_yvyfi": 1_000 * 10 ** 18,
+    "treasury_yfi": 1_000 * 10 ** 18,
+    "treasury_usdc": 10 ** 12,
+}
+
+
+# Vote counts are pareto distributed so a few contributors get most of the votes,
+# about a tenth of the circle gets none and about 1% of the rewarded end up excluded
+def make_synthetic_circle(size, seed=0):
+    rng = random.Random(seed + size)
+    lines = ["name,address,received,sent,epoch_number"]
+    exclusion_list = []
+    for i in range(size):
+        address = "0x" + rng.getrandbits(160).to_bytes(20, "big").hex()
+        received = 0 if rng.random() < 0.1 else int(rng.paretovariate(1.2))
+        lines.append(f"contributor_{i},{address},{received},{rng.randint(0, 100)},{size}")
+        if received > 0 and rng.random() < 0.01:
+            exclusion_list.append(address)
+    return "\n".join(lines) + "\n", exclusion_list
+
+
+# Stand-in for the coordinape api, the epoch number picks which synthetic circle is served
+def start_server(circles):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            epoch = int(parse_qs(urlparse(self.path).query)["epoch"][0])
+            body = circles[epoch].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def time_best_of(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_size(size, exclusion_list, endpoint_format, output_dir, repeat):
+    results = {}
+
+    def fetch():
+        fetcher = EpochResultsFetcher(EpochResultsCache(tempfile.mkdtemp(dir=output_dir)), endpoint_format)
+        epoch = CoordinapeGroupEpoch(BENCHMARK_GROUP, size, exclusion_list, ExclusionMethod.REDISTRIBUTE_SHARE, fetcher)
+        epoch.get_contributors_from_epoch()
+        return epoch
+
+    results["fetch"], coordinape_group_epoch = time_best_of(fetch, repeat)
+
+    # A new CoordinapeGroupEpoch each time so nothing is memoized, the csv comes from the warm cache
+    def parse_filter():
+        epoch = CoordinapeGroupEpoch(BENCHMARK_GROUP, size, exclusion_list, ExclusionMethod.REDISTRIBUTE_SHARE, coordinape_group_epoch.fetcher)
+        return epoch.get_rewarded_contributors_this_epoch(), epoch.get_total_votes()
+
+    results["parse_filter"], _ = time_best_of(parse_filter, repeat)
+
+    for exclusion_type in ExclusionMethod:
+        coordinape_group_epoch.exclusion_type = exclusion_type
+
+        def get_amounts():
+            snapshot = ChainSnapshot.from_dict(BENCHMARK_STATE)
+            disbursement = Disbursement(40_000, FundingMethod.DEPOSIT_YFI, None, EXPECTED_YVYFI_BUFFER, snapshot)
+            disbursement.get_amounts(coordinape_group_epoch)
+            return disbursement
+
+        results[f"get_amounts_{exclusion_type.name.lower()}"], disbursement = time_best_of(get_amounts, repeat)
+
+    results["make_table"], _ = time_best_of(
+        lambda: make_table(
+            coordinape_group_epoch,
+            disbursement.contributors,
+            disbursement.amounts,
+            disbursement.snapshot.yfi_decimal_multiplicand,
+            disbursement.yfi_in_usd,
+            disbursement.snapshot.price_per_share,
+            coordinape_group_epoch.get_total_votes(),
+            str(pathlib.Path(output_dir) / "output_{0}_{1}.csv"),
+        ),
+        repeat,
+    )
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3):
+    circles = {}
+    exclusion_lists = {}
+    for size in sizes:
+        circles[size], exclusion_lists[size] = make_synthetic_circle(size)
+
+    server = start_server(circles)
+    endpoint_format = f"http://127.0.0.1:{server.server_port}/api/{{0}}/csv?epoch={{1}}"
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            for size in sizes:
+                results[str(size)] = benchmark_size(size, exclusion_lists[size], endpoint_format, output_dir, repeat)
+    finally:
+        server.shutdown()
+    return results
+
+
+# Starts a new interpreter per offline command that only imports the cli and that command's
+# module, {command: seconds}. Fails if any of them pulls in one of HEAVY_MODULES.
+def measure_cold_start(repeat=3):
+    results = {}
+    for command, module in OFFLINE_COMMAND_MODULES.items():
+        code = f"import sys, scripts.cli, {module}; sys.exit(sorted(set({HEAVY_MODULES!r}) & set(sys.modules)) or None)"
+
+        def start():
+            return subprocess.run(
+                [sys.executable, "-c", code], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True
+            )
+
+        results[command], process = time_best_of(start, repeat)
+        assert process.returncode == 0, f"{command} imports {process.stderr.strip()} at startup"
+    return results
+
+
+# Returns (size, benchmark, baseline seconds, seconds) for everything that got slower than
+# threshold, and by at least min_delta seconds
+def find_regressions(baseline, results, threshold, min_delta=MIN_REGRESSION_SECONDS):
+    regressions = []
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            baseline_seconds = baseline.get(size, {}).get(name)
+            if baseline_seconds is None or seconds - baseline_seconds < min_delta:
+                continue
+            if seconds > baseline_seconds * (1 + threshold):
+                regressions.append((size, name, baseline_seconds, seconds))
+    return regressions
+
+
+def main(argv=None):
+    from tabulate import tabulate
+
+    parser = argparse.ArgumentParser(description="Benchmark the offline disbursement paths on synthetic circles")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--min-delta", type=float, default=MIN_REGRESSION_SECONDS, help="ignore slowdowns of fewer seconds than this")
+    parser.add_argument("--cold-start-budget", type=float, default=COLD_START_BUDGET, help="seconds an offline command may take to start")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat)
+    names = list(next(iter(results.values())))
+    print(
+        tabulate(
+            [[size] + ["{:0.4f}".format(timings[name]) for name in names] for size, timings in results.items()],
+            headers=["Contributors"] + names,
+            tablefmt="orgtbl",
+        )
+    )
+
+    results["cold_start"] = measure_cold_start(args.repeat)
+    print()
+    print(
+        tabulate(
+            [[command, "{:0.4f}".format(seconds)] for command, seconds in results["cold_start"].items()],
+            headers=["Command", "Cold start"],
+            tablefmt="orgtbl",
+        )
+    )
+    over_budget = [command for command, seconds in results["cold_start"].items() if seconds > args.cold_start_budget]
+    for command in over_budget:
+        print(f"{command} took {results['cold_start'][command]:0.4f}s to start, the budget is {args.cold_start_budget}s")
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(json.load(baseline_file), results, args.threshold, args.min_delta)
+        for size, name, baseline_seconds, seconds in regressions:
+            print(f"{name} with {size} contributors slowed down from {baseline_seconds:0.4f}s to {seconds:0.4f}s")
+        if regressions:
+            return 1
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
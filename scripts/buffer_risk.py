@@ -0,0 +1,148 @@
+import sys
+import pathlib
+from collections import namedtuple
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from scripts.constants import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
+
+# Drift and volatility of log pricePerShare and log YFI/USD, per hour
+BufferRiskModel = namedtuple("BufferRiskModel", ["pps_drift", "pps_volatility", "yfi_drift", "yfi_volatility"])
+
+SECONDS_PER_HOUR = 60 * 60
+
+
+# Fits the model to PricePoints from the price series, ordered by block
+def estimate_model(price_points):
+    import numpy as np
+
+    assert len(price_points) > 2, "Need at least three price points to estimate volatility"
+    hours = np.diff([point.timestamp for point in price_points]) / SECONDS_PER_HOUR
+    fitted = []
+    for values in ([point.price_per_share for point in price_points], [point.yfi_in_usd for point in price_points]):
+        log_returns = np.diff(np.log(values))
+        drift = log_returns.sum() / hours.sum()
+        volatility = np.sqrt(((log_returns - drift * hours) ** 2 / hours).mean())
+        fitted.extend([drift, volatility])
+    return BufferRiskModel(*fitted)
+
+
+# Growth factors of pricePerShare and of the YFI price over the signing delay, one per path
+def simulate_growth(model, hours, paths, seed=None):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    sqrt_hours = np.sqrt(hours)
+    pps_growth = np.exp(
+        (model.pps_drift - model.pps_volatility ** 2 / 2) * hours + model.pps_volatility * sqrt_hours * rng.standard_normal(paths)
+    )
+    yfi_growth = np.exp(
+        (model.yfi_drift - model.yfi_volatility ** 2 / 2) * hours + model.yfi_volatility * sqrt_hours * rng.standard_normal(paths)
+    )
+    return pps_growth, yfi_growth
+
+
+# Probability that the safe tx fails at execution for each buffer, given a Disbursement that
+# hasn't been funded yet. Amounts are sized the way prep_reward sizes them at signing time and
+# the deposit/swap happen at the simulated prices. Returns an array lined up with buffers.
+# A MARKET_BUY swap that reverts on its minimum out isn't counted, no buffer helps with that
+# and the safe tx gets built again from a fresh quote, see get_swap_revert_probability.
+def get_failure_probabilities(disbursement, buffers, pps_growth, yfi_growth):
+    import numpy as np
+
+    buffers = np.asarray(buffers, dtype=float)[None, :]
+    pps_growth = pps_growth[:, None]
+    yfi_growth = yfi_growth[:, None]
+    ratio = disbursement.yvyfi_ratio
+    yvyfi_before = float(disbursement.yvyfi_before)
+    yfi_before = float(disbursement.yfi_before)
+    yfi_allocated = float(disbursement.yfi_allocated)
+    yvyfi_to_disperse = float(disbursement.yvyfi_to_disperse)
+    needs_yvyfi = yvyfi_before / yvyfi_to_disperse < buffers
+    needs_yfi = yfi_before / yfi_allocated < buffers
+    funding_method = disbursement.funding_method
+
+    if funding_method in (FundingMethod.TRANSFER_YVYFI, FundingMethod.TRANSFER_YVYFI_FROM_TREASURY):
+        # The yvYFI amounts are fixed, pricePerShare moving can't make the disperse fail
+        failed = np.zeros((pps_growth.shape[0], buffers.shape[1]), dtype=bool)
+    elif funding_method == FundingMethod.DEPOSIT_ALL_YFI_TO_YVYFI:
+        failed = yvyfi_before + yfi_before / (ratio * pps_growth) < yvyfi_to_disperse
+        failed = np.broadcast_to(failed, (pps_growth.shape[0], buffers.shape[1]))
+    else:
+        yfi_to_deposit = yfi_allocated * (1 + np.where(needs_yvyfi, buffers * ratio, 0))
+        failed = yvyfi_before + yfi_to_deposit / (ratio * pps_growth) < yvyfi_to_disperse
+
+        if funding_method == FundingMethod.MARKET_BUY:
+            yfi_to_buy = yfi_allocated * (1 + np.where(needs_yfi & needs_yvyfi, buffers * ratio, 0))
+            yfi_bought = yfi_to_buy / yfi_growth
+            failed = (failed | (yfi_before + yfi_bought < yfi_to_deposit)) & ~swap_reverts(yfi_growth)
+
+    return failed.mean(axis=0)
+
+
+# The minimum out is the quote at signing less SWAP_SLIPPAGE, see Disbursement.get_swap_legs
+def swap_reverts(yfi_growth):
+    return yfi_growth > 1 / (1 - SWAP_SLIPPAGE)
+
+
+def get_swap_revert_probability(yfi_growth):
+    return swap_reverts(yfi_growth).mean()
+
+
+# Smallest buffer whose failure probability is at most max_failure_probability, None if none is
+def recommend_buffer(buffers, failure_probabilities, max_failure_probability=BUFFER_MAX_FAILURE_PROBABILITY):
+    for buffer, failure_probability in zip(buffers, failure_probabilities):
+        if failure_probability <= max_failure_probability:
+            return float(buffer)
+    return None
+
+
+# Sweeps buffers for an epoch against a saved state snapshot (see plan.py save_state).
+# Volatility comes from the cached price series unless a model is given.
+def simulate_buffer(
+    group,
+    epoch,
+    state_path,
+    funding_method=FundingMethod.DEPOSIT_YFI,
+    model=None,
+    hours=BUFFER_SIGNING_DELAY_HOURS,
+    paths=BUFFER_SIMULATION_PATHS,
+    buffers=None,
+    max_failure_probability=BUFFER_MAX_FAILURE_PROBABILITY,
+    seed=None,
+):
+    import numpy as np
+    from tabulate import tabulate
+    from scripts.chain_snapshot import ChainSnapshot
+    from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+    from scripts.disbursement_index import load_disbursement_index
+    from scripts.disbursement import Disbursement
+
+    if buffers is None:
+        buffers = np.linspace(0, 0.05, 51)
+    if model is None:
+        from scripts.price_series import PriceSeries
+
+        model = estimate_model(PriceSeries().between(0, 2 ** 63 - 1))
+
+    reward_in_usd = CoordinapeGroupEpoch(group, epoch, [], ExclusionMethod.REDISTRIBUTE_SHARE).get_reward_in_usd(load_disbursement_index())
+    disbursement = Disbursement(reward_in_usd, funding_method, None, EXPECTED_YVYFI_BUFFER, ChainSnapshot.load(state_path))
+    pps_growth, yfi_growth = simulate_growth(model, hours, paths, seed)
+    failure_probabilities = get_failure_probabilities(disbursement, buffers, pps_growth, yfi_growth)
+    buffer = recommend_buffer(buffers, failure_probabilities, max_failure_probability)
+
+    print(
+        tabulate(
+            [["{:0.2%}".format(b), "{:0.4%}".format(p)] for b, p in zip(buffers, failure_probabilities)],
+            headers=["Buffer", "Failure probability"],
+            tablefmt="orgtbl",
+        )
+    )
+    if funding_method == FundingMethod.MARKET_BUY:
+        print(
+            f"The swap's {SWAP_SLIPPAGE:0.1%} slippage makes it revert {get_swap_revert_probability(yfi_growth):0.4%} of the time, the safe tx is then built again"
+        )
+    if buffer is None:
+        print(f"No buffer up to {buffers[-1]:0.2%} keeps the failure probability under {max_failure_probability:0.2%}")
+    else:
+        print(f"Smallest buffer with at most {max_failure_probability:0.2%} chance of failing after {hours}h: {buffer:0.2%}")
+    return buffer, failure_probabilities
@@ -0,0 +1,188 @@
+import json
+from scripts.constants import *
+
+SNAPSHOT_FIELDS = (
+    "yvyfi_total_assets",
+    "yvyfi_total_supply",
+    "yvyfi_price_per_share",
+    "yfi_usd_answer",
+    "yfi_usd_decimals",
+    "usdc_decimals",
+    "treasury_governance",
+    "safe_yvyfi",
+    "safe_yfi",
+    "safe_usdc",
+    "treasury_yvyfi",
+    "treasury_yfi",
+    "treasury_usdc",
+)
+
+TOKEN_FIELD_PREFIXES = {
+    YFI_ADDRESS.lower(): "yfi",
+    YEARN_VAULT_YFI_ADDRESS.lower(): "yvyfi",
+    USDC_ADDRESS.lower(): "usdc",
+}
+
+
+# All the vault, oracle and balance state a Disbursement needs, read at a single block
+# in one batched multicall. Calculations run off these numbers instead of live contract
+# reads, so they stay consistent with each other. Call refresh() after a state changing step.
+#
+# A snapshot without contracts (see from_dict/load) is an offline model of the chain:
+# refresh() is a no-op and apply() simulates planned transactions against the balances.
+class ChainSnapshot:
+    def __init__(self, contracts, block=None):
+        self.contracts = contracts
+        self.yfi_decimal_multiplicand = contracts.yfi_decimal_multiplicand
+        self.safe_address = str(contracts.safe.account)
+        self.block = None
+        self.refresh(block)
+
+
+    @classmethod
+    def from_dict(cls, state):
+        missing = [field for field in SNAPSHOT_FIELDS + ("safe_address",) if field not in state]
+        assert len(missing) == 0, f"Snapshot state is missing {missing}"
+
+        snapshot = cls.__new__(cls)
+        snapshot.contracts = None
+        snapshot.yfi_decimal_multiplicand = int(state.get("yfi_decimal_multiplicand", 10 ** 18))
+        snapshot.safe_address = state["safe_address"]
+        snapshot.block = state.get("block")
+        for field in SNAPSHOT_FIELDS:
+            value = state[field]
+            setattr(snapshot, field, value if field == "treasury_governance" else int(value))
+        return snapshot
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as state_file:
+            return cls.from_dict(json.load(state_file))
+
+
+    def to_dict(self):
+        state = {
+            "block": self.block,
+            "safe_address": self.safe_address,
+            "yfi_decimal_multiplicand": int(self.yfi_decimal_multiplicand),
+        }
+        for field in SNAPSHOT_FIELDS:
+            value = getattr(self, field)
+            state[field] = str(value) if field == "treasury_governance" else int(value)
+        return state
+
+
+    def save(self, path):
+        with open(path, "w") as state_file:
+            json.dump(self.to_dict(), state_file, indent=2)
+
+
+    def get_calls(self):
+        safe = self.safe_address
+        treasury = self.contracts.treasury
+        return {
+            "yvyfi_total_assets": (self.contracts.yvyfi.totalAssets, ()),
+            "yvyfi_total_supply": (self.contracts.yvyfi.totalSupply, ()),
+            "yvyfi_price_per_share": (self.contracts.yvyfi.pricePerShare, ()),
+            "yfi_usd_answer": (self.contracts.yfi_usd_oracle.latestAnswer, ()),
+            "yfi_usd_decimals": (self.contracts.yfi_usd_oracle.decimals, ()),
+            "usdc_decimals": (self.contracts.usdc.decimals, ()),
+            "treasury_governance": (self.contracts.treasury.governance, ()),
+            "safe_yvyfi": (self.contracts.yvyfi.balanceOf, (safe,)),
+            "safe_yfi": (self.contracts.yfi.balanceOf, (safe,)),
+            "safe_usdc": (self.contracts.usdc.balanceOf, (safe,)),
+            "treasury_yvyfi": (self.contracts.yvyfi.balanceOf, (treasury,)),
+            "treasury_yfi": (self.contracts.yfi.balanceOf, (treasury,)),
+            "treasury_usdc": (self.contracts.usdc.balanceOf, (treasury,)),
+        }
+
+
+    def refresh(self, block=None):
+        if self.contracts is None:
+            return self
+
+        from brownie import chain
+        from scripts.multicall import Multicall
+
+        if block is None:
+            block = chain.height
+        calls = self.get_calls()
+        values = Multicall(self.contracts).aggregate(list(calls.values()), block)
+        for name, value in zip(calls, values):
+            setattr(self, name, value)
+        self.block = block
+        return self
+
+
+    def get_token_prefix(self, token):
+        prefix = TOKEN_FIELD_PREFIXES.get(str(token).lower())
+        assert prefix is not None, f"Can't simulate balances of {token}"
+        return prefix
+
+
+    def move(self, token, source, destination, amount):
+        prefix = self.get_token_prefix(token)
+        source_field = f"{source}_{prefix}"
+        assert getattr(self, source_field) >= amount, f"{source} doesn't have {amount} of {prefix}"
+        setattr(self, source_field, getattr(self, source_field) - amount)
+        if destination is not None:
+            destination_field = f"{destination}_{prefix}"
+            setattr(self, destination_field, getattr(self, destination_field) + amount)
+
+
+    # Offline model of the state changes a planned transaction makes
+    def apply(self, planned_tx):
+        args = planned_tx.args
+        if planned_tx.method == "approve" or planned_tx.method == "setDepositLimit":
+            return
+        elif planned_tx.method == "toGovernance":
+            token, amount = args
+            self.move(token, "treasury", "safe", int(amount))
+        elif planned_tx.method == "deposit":
+            amount = int(args[0])
+            shares = amount * self.yvyfi_total_supply // self.yvyfi_total_assets
+            self.move(YFI_ADDRESS, "safe", None, amount)
+            self.safe_yvyfi += shares
+            self.yvyfi_total_assets += amount
+            self.yvyfi_total_supply += shares
+        elif planned_tx.method == "swapExactTokensForTokens":
+            amount_in, amount_out_min, path = int(args[0]), int(args[1]), args[2]
+            assert self.get_token_prefix(path[0]) == "usdc" and self.get_token_prefix(path[-1]) == "yfi"
+            # The pool quote the swap was planned with, or without one the oracle price
+            amount_out = planned_tx.expected_amount_out
+            if amount_out is None:
+                amount_out = int(amount_in / self.usdc_decimal_multiplicand / self.yfi_in_usd * self.yfi_decimal_multiplicand)
+            assert amount_out >= amount_out_min, f"The swap would revert, it returns {amount_out} YFI and needs at least {amount_out_min}"
+            self.move(USDC_ADDRESS, "safe", None, amount_in)
+            self.safe_yfi += amount_out
+        elif planned_tx.method == "disperseToken":
+            token, recipients, amounts = args
+            self.move(token, "safe", None, sum(amounts))
+        else:
+            raise ValueError(f"Can't simulate {planned_tx.contract}.{planned_tx.method}")
+
+
+    @property
+    def yfi_in_usd(self):
+        return self.yfi_usd_answer / 10 ** self.yfi_usd_decimals
+
+
+    @property
+    def yvyfi_ratio(self):
+        return self.yvyfi_total_assets / self.yvyfi_total_supply
+
+
+    @property
+    def price_per_share(self):
+        return self.yvyfi_price_per_share / self.yfi_decimal_multiplicand
+
+
+    @property
+    def usdc_decimal_multiplicand(self):
+        return 10 ** self.usdc_decimals
+
+
+    @property
+    def safe_is_treasury_governance(self):
+        return str(self.treasury_governance).lower() == self.safe_address.lower()
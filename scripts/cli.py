@@ -0,0 +1,159 @@
+import argparse
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from scripts.constants import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
+
+# Command line entry point, e.g.
+# python scripts/cli.py fetch
+# python scripts/cli.py plan community 9 state.json --funding-method deposit_yfi
+# python scripts/cli.py report community 8
+# python scripts/cli.py disperse community 9 --network mainnet-fork
+# python scripts/cli.py disperse community 9 --no-replay
+# Each command imports what it needs when it runs, so the offline ones never load
+# brownie, web3 or pytest. benchmark.py checks how long they take to start.
+
+# The module each offline command loads, used by the cold start benchmark
+OFFLINE_COMMAND_MODULES = {
+    "fetch": "scripts.epoch_results_fetcher",
+    "plan": "scripts.plan",
+    "report": "scripts.history",
+}
+
+
+# Enum members by case-insensitive name, e.g. "deposit_yfi" for FundingMethod.DEPOSIT_YFI
+def enum_argument(enum):
+    def parse(name):
+        try:
+            return enum[name.upper()]
+        except KeyError:
+            raise argparse.ArgumentTypeError(f"{name} is not one of {', '.join(member.name.lower() for member in enum)}")
+
+    parse.__name__ = enum.__name__
+    return parse
+
+
+def get_exclusion_list(args):
+    return args.exclude_file if args.exclude_file is not None else args.exclude
+
+
+def fetch(args):
+    from scripts.epoch_results_fetcher import EpochResultsFetcher, get_configured_group_epochs
+
+    if args.group is None:
+        group_epochs = get_configured_group_epochs()
+    else:
+        group_epochs = [(args.group, epoch) for epoch in args.epochs]
+    texts = EpochResultsFetcher().fetch_many(group_epochs, args.revalidate)
+    for (group, epoch), text in texts.items():
+        print(f"{group.name} epoch #{epoch}: {max(len(text.splitlines()) - 1, 0)} contributors")
+
+
+def plan(args):
+    from scripts.plan import plan
+
+    plan(
+        args.group,
+        args.epoch,
+        args.state,
+        args.funding_method,
+        get_exclusion_list(args),
+        args.exclusion_type,
+        args.nonce,
+        args.safe_version,
+        args.chain_id,
+    )
+
+
+def report(args):
+    from scripts.history import report_epoch
+
+    report_epoch(args.group, args.epoch)
+
+
+def disperse(args):
+    from brownie import network
+    from scripts.coordinape_disperse import disperse, disperse_without_replay
+
+    network.connect(args.network)
+    if args.no_replay:
+        disperse_without_replay(
+            args.group,
+            args.epoch,
+            args.safe,
+            args.funding_method,
+            get_exclusion_list(args),
+            args.exclusion_type,
+            not args.skip_preview,
+            args.profile,
+        )
+    else:
+        disperse(
+            args.group,
+            args.epoch,
+            args.safe,
+            args.funding_method,
+            get_exclusion_list(args),
+            args.exclusion_type,
+            args.profile,
+        )
+
+
+def add_group_epoch_arguments(parser):
+    parser.add_argument("group", type=enum_argument(CoordinapeGroup))
+    parser.add_argument("epoch", type=int)
+
+
+def add_disbursement_arguments(parser):
+    parser.add_argument("--funding-method", type=enum_argument(FundingMethod), default=FundingMethod.DEPOSIT_YFI)
+    parser.add_argument("--exclusion-type", type=enum_argument(ExclusionMethod), default=ExclusionMethod.REDISTRIBUTE_SHARE)
+    exclusions = parser.add_mutually_exclusive_group()
+    exclusions.add_argument("--exclude", nargs="+", default=[], metavar="ADDRESS", help="contributors to exclude")
+    exclusions.add_argument("--exclude-file", help="file with one address to exclude per line")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Coordinape yvYFI disbursements")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="download epoch results into the local cache")
+    fetch_parser.add_argument("group", nargs="?", type=enum_argument(CoordinapeGroup), help="defaults to every configured epoch")
+    fetch_parser.add_argument("epochs", nargs="*", type=int)
+    fetch_parser.add_argument("--revalidate", action="store_true", help="ask the api whether cached results changed")
+    fetch_parser.set_defaults(run=fetch)
+
+    plan_parser = subparsers.add_parser("plan", help="preview a disbursement against a saved state, no fork needed")
+    add_group_epoch_arguments(plan_parser)
+    plan_parser.add_argument("state", help="state saved with plan.py save_state")
+    plan_parser.add_argument("--nonce", type=int, help="also build the safe transaction with this nonce")
+    plan_parser.add_argument("--safe-version", default=SAFE_VERSION)
+    plan_parser.add_argument("--chain-id", type=int, default=1)
+    add_disbursement_arguments(plan_parser)
+    plan_parser.set_defaults(run=plan)
+
+    report_parser = subparsers.add_parser("report", help="rebuild a past epoch's report from the local history")
+    add_group_epoch_arguments(report_parser)
+    report_parser.set_defaults(run=report)
+
+    disperse_parser = subparsers.add_parser("disperse", help="fund and disperse on a network and post the safe transaction")
+    add_group_epoch_arguments(disperse_parser)
+    disperse_parser.add_argument("--safe", default=YCHAD_ETH)
+    disperse_parser.add_argument("--network", default="mainnet-fork")
+    disperse_parser.add_argument("--profile", action="store_true", help="write profile_<group>_<epoch>.json")
+    disperse_parser.add_argument("--no-replay", action="store_true", help="encode the safe transaction from the plan instead of fork receipts")
+    disperse_parser.add_argument("--skip-preview", action="store_true", help="with --no-replay, post without running it on the fork first")
+    add_disbursement_arguments(disperse_parser)
+    disperse_parser.set_defaults(run=disperse)
+
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    args.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,12 @@ from scripts.coordinape_enums import CoordinapeGroup
 # https://etherscan.io/tx/0xf401d432dcaaea39e1b593379d3d63dcdc82f5f694d83b098bb6110eaa19bbde
 
 LEFTOVER_DICT = {CoordinapeGroup.COMMUNITY: {2: 6902}}
+# Disperse transactions tied to their epoch by hand, for the ones the disbursement index can't
+# match to an epoch's results itself. Leftovers of epochs missing from LEFTOVER_DICT are worked
+# out from what was actually paid.
+DISPERSE_TX_DICT = {
+    CoordinapeGroup.COMMUNITY: {2: "0xf401d432dcaaea39e1b593379d3d63dcdc82f5f694d83b098bb6110eaa19bbde"},
+}
 DEFAULT_USD_REWARD_DICT = {
     CoordinapeGroup.COMMUNITY: {1: 40_000, 2: 40_000, 3: 40_000, 4: 60_000, 5: 60_000, 6: 75_000, 7: 75_000, 8: 75_000, 9: 75_000},
     CoordinapeGroup.YSTRATEGIST: {1: 40_000, 2: 40_000, 3: 40_000, 4: 70_000, 5: 44_000, 6: 50_000, 7: 50_000, 8: 50_000},
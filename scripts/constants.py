@@ -10,5 +10,53 @@ YEARN_TREASURY_ADDRESS = "0x93A62dA5a14C80f265DAbC077fCEE437B1a0Efde"
 SUSHISWAP_ADDRESS = "0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F"
 USDC_ADDRESS = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
 WETH_ADDRESS = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+SUSHISWAP_FACTORY_ADDRESS = "0xC0AEe478e3658e2610c5F7A4A2E1777cE9e4f2Ac"
+MULTICALL2_ADDRESS = "0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696"
+MULTISEND_ADDRESS = "0x8D29bE29923b68abfDD21e541b9374737B49cdAD"
 
-EXPECTED_YVYFI_BUFFER = 0.01
\ No newline at end of file
+EXPECTED_YVYFI_BUFFER = 0.01
+BUFFER_SIGNING_DELAY_HOURS = 48
+BUFFER_MAX_FAILURE_PROBABILITY = 0.001
+BUFFER_SIMULATION_PATHS = 100_000
+MULTICALL_CHUNK_SIZE = 500
+SWAP_ROUTES = [
+    [USDC_ADDRESS, WETH_ADDRESS, YFI_ADDRESS],
+    [USDC_ADDRESS, YFI_ADDRESS],
+]
+SWAP_SPLIT_STEPS = 200
+# The swap's minimum out is the pool quote less SWAP_SLIPPAGE and it expires SWAP_DEADLINE_HOURS
+# after it's built. If the price moves further than that before the owners sign, the swap
+# reverts and the safe tx has to be built again from a fresh quote.
+SWAP_SLIPPAGE = 0.005
+SWAP_DEADLINE_HOURS = BUFFER_SIGNING_DELAY_HOURS
+# How far below the oracle estimate the pool quote may be when planning
+SWAP_ORACLE_TOLERANCE = 0.03
+EPOCH_RESULTS_CACHE_DIR = ".cache/epoch_results"
+EPOCH_RESULTS_MAX_WORKERS = 8
+EPOCH_RESULTS_TIMEOUT = 30
+EPOCH_RESULTS_RETRIES = 5
+EPOCH_RESULTS_BACKOFF_FACTOR = 0.5
+CONTRACT_CACHE_DIR = ".cache/contracts"
+PROFILE_OUTPUT_FORMAT = "profile_{0}.json"
+REPORT_CONSOLE_TOP_N = 100
+DISBURSEMENT_INDEX_PATH = ".cache/disbursements.sqlite"
+DISBURSEMENT_INDEX_START_BLOCK = 12_000_000
+DISBURSEMENT_INDEX_BLOCK_CHUNK = 20_000
+PRICE_SERIES_PATH = ".cache/prices.sqlite"
+PRICE_SERIES_BLOCK_STEP = 6_500
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+# Rough gas for a safe transaction dispersing yvYFI: the safe's execTransaction and multisend
+# overhead, an approve and disperse.app's disperseToken call, and a transfer per recipient,
+# which costs more when the recipient doesn't hold any yvYFI yet. The first safe transaction
+# also carries the funding calls.
+DISPERSE_CHUNK_GAS_CAP = 8_000_000
+SAFE_TX_BASE_GAS = 100_000
+FUNDING_GAS = 600_000
+DISPERSE_BASE_GAS = 80_000
+DISPERSE_GAS_PER_HOLDER = 20_000
+DISPERSE_GAS_PER_NEW_HOLDER = 40_000
+
+# ychad.eth is a v1.1.1 safe, newer safes sign over the chain id too
+SAFE_VERSION = "1.1.1"
+SAFE_TX_OUTPUT_FORMAT = "safe_tx_{0}_{1}.json"
@@ -0,0 +1,75 @@
+import json
+import pathlib
+from scripts.constants import *
+
+
+# Local cache of what we learn about contracts that never changes for a given
+# chain/address: explorer ABIs, ENS resolutions and immutable values like decimals.
+# Laid out as <cache_dir>/<chain id>/<address>.json plus <cache_dir>/<chain id>/ens.json
+class ContractCache:
+    def __init__(self, cache_dir=CONTRACT_CACHE_DIR):
+        self.cache_dir = pathlib.Path(cache_dir)
+
+
+    def get_chain_dir(self, chain_id):
+        return self.cache_dir / str(chain_id)
+
+
+    @staticmethod
+    def read_json(path):
+        if not path.exists():
+            return {}
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except ValueError:
+            # A corrupt entry is just a cache miss
+            return {}
+
+
+    @staticmethod
+    def write_json(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        tmp_path.replace(path)
+
+
+    def get_contract_path(self, chain_id, address):
+        return self.get_chain_dir(chain_id) / f"{address.lower()}.json"
+
+
+    def get_contract(self, chain_id, address):
+        return self.read_json(self.get_contract_path(chain_id, address))
+
+
+    def put_abi(self, chain_id, address, name, abi):
+        entry = self.get_contract(chain_id, address)
+        entry.update({"name": name, "abi": abi})
+        self.write_json(self.get_contract_path(chain_id, address), entry)
+
+
+    def get_immutable(self, chain_id, address, key):
+        return self.get_contract(chain_id, address).get("immutables", {}).get(key)
+
+
+    def put_immutable(self, chain_id, address, key, value):
+        entry = self.get_contract(chain_id, address)
+        entry.setdefault("immutables", {})[key] = value
+        self.write_json(self.get_contract_path(chain_id, address), entry)
+
+
+    def get_ens(self, chain_id, name):
+        return self.read_json(self.get_chain_dir(chain_id) / "ens.json").get(name)
+
+
+    def put_ens(self, chain_id, name, address):
+        path = self.get_chain_dir(chain_id) / "ens.json"
+        resolutions = self.read_json(path)
+        resolutions[name] = address
+        self.write_json(path, resolutions)
+
+
+    def clear(self, chain_id=None):
+        paths = self.cache_dir.glob("*/*.json") if chain_id is None else self.get_chain_dir(chain_id).glob("*.json")
+        for path in paths:
+            path.unlink()
@@ -1,19 +1,84 @@
 from scripts.constants import *
 from scripts.configuration import *
 from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
-from ape_safe import ApeSafe
+from scripts.contract_cache import ContractCache
+from scripts.profiler import Profiler
 
+CONTRACT_ADDRESSES = {
+    "yfi": YFI_ADDRESS,
+    "yvyfi": YEARN_VAULT_YFI_ADDRESS,
+    "disperse": DISPERSE_APP_ADDRESS,
+    "treasury": YEARN_TREASURY_ADDRESS,
+    "sushiswap": SUSHISWAP_ADDRESS,
+    "sushiswap_factory": SUSHISWAP_FACTORY_ADDRESS,
+    "usdc": USDC_ADDRESS,
+    "weth": WETH_ADDRESS,
+    "yfi_usd_oracle": YFI_USD_ORACLE_ADDRESS,
+    "multicall": MULTICALL2_ADDRESS,
+}
+
+
+# Contracts are only loaded the first time they're used, e.g. contracts.yvyfi.
+# ABIs, ENS names and decimals are kept in a ContractCache so later runs don't
+# need explorer lookups or extra RPCs to set things up.
 class Contracts:
-    def __init__(self, safe_name):
+    def __init__(self, safe_name, cache=None, profiler=None):
+        from ape_safe import ApeSafe
+
         self.safe = ApeSafe(safe_name)
-        self.yfi = self.safe.contract(YFI_ADDRESS)
-        self.yfi_decimal_multiplicand = 10 ** self.yfi.decimals()
+        self.cache = ContractCache() if cache is None else cache
+        self.profiler = Profiler() if profiler is None else profiler
+        self._yfi_decimal_multiplicand = None
+
+
+    def __getattr__(self, name):
+        if name not in CONTRACT_ADDRESSES:
+            raise AttributeError(f"{type(self).__name__} has no attribute {name}")
+        contract = self.load_contract(CONTRACT_ADDRESSES[name])
+        setattr(self, name, contract)
+        return contract
+
+
+    @property
+    def chain_id(self):
+        from brownie import chain
+
+        return chain.id
+
+
+    def resolve_address(self, address):
+        if not address.endswith(".eth"):
+            return address
+
+        resolved = self.cache.get_ens(self.chain_id, address)
+        if resolved is None:
+            from brownie import web3
+
+            resolved = web3.ens.resolve(address)
+            assert resolved is not None, f"Couldn't resolve {address}"
+            self.cache.put_ens(self.chain_id, address, resolved)
+        return resolved
+
+
+    def load_contract(self, address):
+        from brownie import Contract
+
+        address = self.resolve_address(address)
+        entry = self.cache.get_contract(self.chain_id, address)
+        if "abi" in entry:
+            return Contract.from_abi(entry["name"], address, entry["abi"], owner=self.safe.account)
+
+        contract = self.safe.contract(address)
+        self.cache.put_abi(self.chain_id, address, contract._name, contract.abi)
+        return contract
 
-        self.yvyfi = self.safe.contract(YEARN_VAULT_YFI_ADDRESS)
-        self.disperse = self.safe.contract(DISPERSE_APP_ADDRESS)
-        self.treasury = self.safe.contract(YEARN_TREASURY_ADDRESS)
 
-        self.sushiswap = self.safe.contract(SUSHISWAP_ADDRESS)
-        self.usdc = self.safe.contract(USDC_ADDRESS)
-        self.weth = self.safe.contract(WETH_ADDRESS)
-        self.yfi_usd_oracle = self.safe.contract(YFI_USD_ORACLE_ADDRESS)
\ No newline at end of file
+    @property
+    def yfi_decimal_multiplicand(self):
+        if self._yfi_decimal_multiplicand is None:
+            decimals = self.cache.get_immutable(self.chain_id, YFI_ADDRESS, "decimals")
+            if decimals is None:
+                decimals = self.yfi.decimals()
+                self.cache.put_immutable(self.chain_id, YFI_ADDRESS, "decimals", decimals)
+            self._yfi_decimal_multiplicand = 10 ** decimals
+        return self._yfi_decimal_multiplicand
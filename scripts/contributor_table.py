@@ -0,0 +1,98 @@
+import csv
+import io
+from array import array
+
+
+# Addresses are compared lowercased, which matches comparing checksummed addresses
+# without paying a keccak per contributor
+def normalize_address(address):
+    address = address.strip().lower()
+    assert len(address) == 42 and address.startswith("0x"), f"{address} is not an address"
+    return address
+
+
+# One address per line, blank lines and lines starting with # are skipped
+def load_exclusion_list(path):
+    with open(path) as exclusion_file:
+        return {
+            normalize_address(line)
+            for line in exclusion_file
+            if line.strip() and not line.lstrip().startswith("#")
+        }
+
+
+# Contributors as parallel columns (names, normalized addresses, integer votes)
+# with a hash index from address to row, instead of a list of csv dicts
+class ContributorTable:
+    __slots__ = ("names", "addresses", "votes", "index")
+
+    def __init__(self, names, addresses, votes):
+        assert len(names) == len(addresses) == len(votes)
+        self.names = names
+        self.addresses = addresses
+        self.votes = votes if isinstance(votes, array) else array("q", votes)
+        self.index = {address: i for i, address in enumerate(addresses)}
+
+
+    @classmethod
+    def from_csv(cls, text):
+        reader = csv.reader(io.StringIO(text))
+        header = next(reader, None)
+        if header is None:
+            return cls([], [], [])
+        name_column = header.index("name")
+        address_column = header.index("address")
+        received_column = header.index("received")
+
+        names = []
+        addresses = []
+        votes = array("q")
+        for row in reader:
+            if not row:
+                continue
+            names.append(row[name_column])
+            addresses.append(normalize_address(row[address_column]))
+            votes.append(int(row[received_column]))
+        return cls(names, addresses, votes)
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __contains__(self, address):
+        return normalize_address(address) in self.index
+
+
+    def find(self, address):
+        return self.index.get(normalize_address(address))
+
+
+    # Row indices of the given normalized addresses that are in the table, in table order
+    def find_all(self, addresses):
+        return sorted(self.index[address] for address in addresses if address in self.index)
+
+
+    def select(self, indices):
+        return ContributorTable(
+            [self.names[i] for i in indices],
+            [self.addresses[i] for i in indices],
+            array("q", (self.votes[i] for i in indices)),
+        )
+
+
+    def with_votes(self):
+        return self.select([i for i, vote in enumerate(self.votes) if vote > 0])
+
+
+    def without(self, addresses):
+        return self.select([i for i, address in enumerate(self.addresses) if address not in addresses])
+
+
+    @property
+    def total_votes(self):
+        return sum(self.votes)
+
+
+    def rows(self):
+        return zip(self.names, self.addresses, self.votes)
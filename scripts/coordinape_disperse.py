@@ -1,64 +1,37 @@
 import sys
 import pathlib
-import csv
 sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
 from brownie import *
+from collections import namedtuple
 from tabulate import tabulate
 from scripts.constants import *
 from scripts.configuration import *
 from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
 from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+from scripts.disbursement_index import load_disbursement_index
 from scripts.contracts import Contracts
 from scripts.disbursement import Disbursement
-
-
-def make_table(coordinape_group_epoch, contributors_this_epoch, amounts, yfi_decimal_multiplicand, yfi_in_usd, price_per_share, total_votes):
-    l = [
-        [
-            contributor["name"],
-            contributor["address"][:6],
-            contributor["received"],
-            amount / yfi_decimal_multiplicand,
-            "${:0.2f}".format(
-                amount / yfi_decimal_multiplicand * yfi_in_usd * price_per_share
-            ),
-        ]
-        for contributor, amount in zip(contributors_this_epoch, amounts)
-    ]
-
-    l.append(
-        [
-            "TOTAL",
-            "------",
-            total_votes,
-            sum(amounts) / yfi_decimal_multiplicand,
-            "${:0.2f}".format(
-                sum(amounts) / yfi_decimal_multiplicand * yfi_in_usd * price_per_share
-            ),
-        ]
-    )
-
-    with open(f'output_{coordinape_group_epoch.group}_{coordinape_group_epoch.epoch}.csv', 'w+') as result_file:
-        wr = csv.writer(result_file, dialect='excel')
-        wr.writerows(l)
-
-    table = tabulate(
-        l,
-        headers=["Name", "Address", "Received Votes", "Amount yvYFI", "Amount USD"],
-        tablefmt="orgtbl",
-    )
-
-    return table
-
-
-def disperse(
-    group,
-    epoch,
-    safe_name=YCHAD_ETH,
-    funding_method=FundingMethod.DEPOSIT_YFI,
-    exclusion_list=[],
-    exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE,
-):
+from scripts.multicall import Multicall
+from scripts.swap_quote import SwapQuoter
+from scripts.report import make_table
+from scripts.profiler import Profiler
+from scripts.chain_snapshot import ChainSnapshot
+from scripts.plan import simulate_disbursement
+from scripts.safe_tx import build_safe_txs, save_safe_txs, to_ape_safe_tx
+
+
+# One group/epoch payout. setup is an optional function called with the safe's
+# Contracts before funding, for one-off steps like raising the vault's deposit limit.
+DisperseJob = namedtuple(
+    "DisperseJob",
+    ["group", "epoch", "safe_name", "funding_method", "exclusion_list", "exclusion_type", "setup"],
+    defaults=[YCHAD_ETH, FundingMethod.DEPOSIT_YFI, [], ExclusionMethod.REDISTRIBUTE_SHARE, None],
+)
+
+
+# Funds and disperses a single job from the safe on the current network, without posting anything
+def run_disperse_job(contracts, job):
+    group, epoch = job.group, job.epoch
     assert (
         group in DEFAULT_USD_REWARD_DICT
     ), f"{group.name} does not have a default usd reward entry"
@@ -66,48 +39,240 @@ def disperse(
         epoch in DEFAULT_USD_REWARD_DICT[group]
     ), f"{group.name}'s epoch #{epoch} does not have a default usd reward entry"
 
-    coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, exclusion_list, exclusion_type)
-    # Figure out the reward and handle leftovers from previous epoch
-    reward_in_usd = coordinape_group_epoch.get_reward_in_usd()
-    rewarded_contributors_this_epoch = coordinape_group_epoch.get_rewarded_contributors_this_epoch()
+    profiler = contracts.profiler
+    with profiler.phase("fetch"):
+        coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, job.exclusion_list, job.exclusion_type)
+        # Figure out the reward and handle leftovers from previous epoch
+        reward_in_usd = coordinape_group_epoch.get_reward_in_usd(load_disbursement_index())
+        rewarded_contributors_this_epoch = coordinape_group_epoch.get_rewarded_contributors_this_epoch()
 
     assert (
         len(rewarded_contributors_this_epoch) > 0
     ), f"{group.name}'s epoch #{epoch} does not have any contributors with votes received..."
 
-    contracts = Contracts(safe_name)
-    disbursement = Disbursement(reward_in_usd, funding_method, contracts, EXPECTED_YVYFI_BUFFER)
-    disbursement.prep_reward()
+    with profiler.phase("get_amounts"):
+        disbursement = Disbursement(reward_in_usd, job.funding_method, contracts, EXPECTED_YVYFI_BUFFER)
+        amounts = disbursement.get_amounts(coordinape_group_epoch)
+
+    with profiler.phase("prep_reward"):
+        if job.setup is not None:
+            job.setup(contracts)
 
-    amounts = disbursement.get_amounts(coordinape_group_epoch)
+        disbursement.prep_reward()
 
-    contracts.yvyfi.approve(contracts.disperse, sum(amounts))
-    recipients = [contributor["address"] for contributor in rewarded_contributors_this_epoch]
-    recipients_yvfi_before = [contracts.yvyfi.balanceOf(recipient) for recipient in recipients]
+    with profiler.phase("disperse"):
+        recipients = disbursement.contributors.addresses
+        multicall = Multicall(contracts)
+        recipients_yvfi_before = multicall.balances_of(contracts.yvyfi, recipients)
 
-    contracts.disperse.disperseToken(contracts.yvyfi, recipients, amounts)
-    history[-1].info()
+        disbursement.disperse_reward(recipients, recipients_yvfi_before)
+        for planned_tx, tx in zip(disbursement.planned_txs, disbursement.receipts):
+            if planned_tx.method == "disperseToken":
+                tx.info()
 
-    disbursement.check_asserts()
+    with profiler.phase("verify"):
+        disbursement.check_asserts()
 
-    # For each recipient, make sure their yvYFI amount increased by the expected amount
-    for recipient, yvyfi_before, amount in zip(
-        recipients, recipients_yvfi_before, amounts
-    ):
-        assert contracts.yvyfi.balanceOf(recipient) == yvyfi_before + amount
+        # For each recipient, make sure their yvYFI amount increased by the expected amount
+        recipients_yvfi_after = multicall.balances_of(contracts.yvyfi, recipients, disbursement.snapshot.block)
+        for chunk_number, chunk in enumerate(disbursement.disperse_chunks):
+            for i in chunk.indices:
+                received = recipients_yvfi_after[i] - recipients_yvfi_before[i]
+                assert received == amounts[i], f"{recipients[i]} received {received} yvYFI instead of {amounts[i]} in chunk #{chunk_number}"
 
     # Print out a table
-    price_per_share = contracts.yvyfi.pricePerShare() / contracts.yfi_decimal_multiplicand
-    table = make_table(coordinape_group_epoch, rewarded_contributors_this_epoch, amounts, contracts.yfi_decimal_multiplicand, disbursement.yfi_in_usd, price_per_share, coordinape_group_epoch.get_total_votes())
+    with profiler.phase("report"):
+        price_per_share = disbursement.snapshot.price_per_share
+        table = make_table(coordinape_group_epoch, disbursement.contributors, amounts, contracts.yfi_decimal_multiplicand, disbursement.yfi_in_usd, price_per_share, coordinape_group_epoch.get_total_votes())
 
     print(
         f"{group.name} epoch #{epoch}\nDistributing ${reward_in_usd}\nYFI price ${disbursement.yfi_in_usd}\nyvYFI price per share {price_per_share}\n"
     )
     print(table)
 
-    safe_tx = contracts.safe.multisend_from_receipts()
-    contracts.safe.preview(safe_tx)
-    contracts.safe.post_transaction(safe_tx)
+    return disbursement
+
+
+# Splits a job's receipts into one list per safe transaction. Everything the safe sent for the
+# job goes into the first one, including setup steps, except the later disperse chunks.
+def get_safe_tx_receipts(contracts, disbursement, job_history):
+    groups = disbursement.get_safe_tx_groups(disbursement.receipts)
+    later_txids = {tx.txid for group in groups[1:] for tx in group}
+    first_group = [tx for tx in job_history if tx.sender == contracts.safe.address and tx.txid not in later_txids]
+    return [first_group] + groups[1:]
+
+
+# Merges a safe's receipt groups, in order, into as few safe transactions as stay under gas_cap
+# going by the gas each call used on the fork. Only a group that doesn't fit starts a new one.
+def pack_receipt_groups(receipt_groups, gas_cap=DISPERSE_CHUNK_GAS_CAP):
+    packed = []
+    packed_gas = 0
+    for receipts in receipt_groups:
+        gas = sum(tx.gas_used for tx in receipts)
+        if packed and SAFE_TX_BASE_GAS + packed_gas + gas <= gas_cap:
+            packed[-1] = packed[-1] + receipts
+            packed_gas += gas
+        else:
+            packed.append(list(receipts))
+            packed_gas = gas
+    return packed
+
+
+# One multisend per group of receipts, with consecutive nonces so they're signed in one round
+def build_safe_transactions(contracts, receipt_groups):
+    with contracts.profiler.phase("safe_build"):
+        nonce = contracts.safe.pending_nonce()
+        return [
+            (contracts, contracts.safe.multisend_from_receipts(receipts, safe_nonce=nonce + i))
+            for i, receipts in enumerate(receipt_groups)
+        ]
+
+
+# preview() resets the chain by default, which also clears the receipts other safes'
+# multisends are built from, so build them all first. Only the first preview resets,
+# later ones run on top of it, so a safe's consecutive transactions are previewed in order.
+def post_safe_transactions(contracts_and_safe_txs, preview=True):
+    for i, (contracts, safe_tx) in enumerate(contracts_and_safe_txs):
+        if preview:
+            with contracts.profiler.phase("safe_preview"):
+                contracts.safe.preview(safe_tx, reset=i == 0)
+    for contracts, safe_tx in contracts_and_safe_txs:
+        with contracts.profiler.phase("safe_post"):
+            contracts.safe.post_transaction(safe_tx)
+
+
+def start_profiler(profile):
+    profiler = Profiler()
+    if profile:
+        profiler.install()
+    return profiler
+
+
+def finish_profiler(profiler, name):
+    if profiler.installed:
+        profiler.uninstall()
+        profiler.write_report(PROFILE_OUTPUT_FORMAT.format(name))
+
+
+def make_batch_table(jobs, disbursements):
+    rows = []
+    for job, disbursement in zip(jobs, disbursements):
+        yvyfi_dispersed = sum(disbursement.amounts) / disbursement.snapshot.yfi_decimal_multiplicand
+        rows.append(
+            [
+                job.group.name,
+                job.epoch,
+                job.safe_name,
+                job.funding_method.name,
+                len(disbursement.amounts),
+                yvyfi_dispersed,
+                "${:0.2f}".format(yvyfi_dispersed * disbursement.yfi_in_usd * disbursement.snapshot.price_per_share),
+            ]
+        )
+    return tabulate(
+        rows,
+        headers=["Group", "Epoch", "Safe", "Funding", "Recipients", "Amount yvYFI", "Amount USD"],
+        tablefmt="orgtbl",
+    )
+
+
+# Runs several jobs back to back in one session. Contracts are loaded once per safe
+# and each safe's jobs share multisends, split only where the gas cap needs it.
+# With profile set, RPCs, timings and gas per phase are written to profile_batch.json.
+def disperse_batch(jobs, profile=False):
+    profiler = start_profiler(profile)
+    contracts_by_safe = {}
+    receipt_groups_by_safe = {}
+    disbursements = []
+    for job in jobs:
+        if job.safe_name not in contracts_by_safe:
+            with profiler.phase("contracts"):
+                contracts_by_safe[job.safe_name] = Contracts(job.safe_name, profiler=profiler)
+            receipt_groups_by_safe[job.safe_name] = []
+        contracts = contracts_by_safe[job.safe_name]
+        history_start = len(history)
+        disbursement = run_disperse_job(contracts, job)
+        receipt_groups_by_safe[job.safe_name] += get_safe_tx_receipts(contracts, disbursement, history[history_start:])
+        disbursements.append(disbursement)
+
+    print(make_batch_table(jobs, disbursements))
+
+    post_safe_transactions(
+        [
+            safe_tx
+            for safe_name, contracts in contracts_by_safe.items()
+            for safe_tx in build_safe_transactions(contracts, pack_receipt_groups(receipt_groups_by_safe[safe_name]))
+        ]
+    )
+
+    finish_profiler(profiler, "batch")
+    return disbursements
+
+
+def disperse(
+    group,
+    epoch,
+    safe_name=YCHAD_ETH,
+    funding_method=FundingMethod.DEPOSIT_YFI,
+    exclusion_list=[],
+    exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE,
+    profile=False,
+):
+    profiler = start_profiler(profile)
+    with profiler.phase("contracts"):
+        contracts = Contracts(safe_name, profiler=profiler)
+    history_start = len(history)
+    disbursement = run_disperse_job(contracts, DisperseJob(group, epoch, safe_name, funding_method, exclusion_list, exclusion_type))
+    post_safe_transactions(build_safe_transactions(contracts, get_safe_tx_receipts(contracts, disbursement, history[history_start:])))
+    finish_profiler(profiler, f"{group.name}_{epoch}")
+
+
+# Builds the multisends straight from the computed amounts instead of executing everything on
+# the fork and collecting receipts. The chain state is read once and the funding and disperse
+# are simulated offline, then encoded into safe transactions. verify runs them once on the
+# fork through preview() before posting.
+def disperse_without_replay(
+    group,
+    epoch,
+    safe_name=YCHAD_ETH,
+    funding_method=FundingMethod.DEPOSIT_YFI,
+    exclusion_list=[],
+    exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE,
+    verify=True,
+    profile=False,
+):
+    profiler = start_profiler(profile)
+    with profiler.phase("contracts"):
+        contracts = Contracts(safe_name, profiler=profiler)
+
+    with profiler.phase("fetch"):
+        coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, exclusion_list, exclusion_type)
+        reward_in_usd = coordinape_group_epoch.get_reward_in_usd(load_disbursement_index())
+        snapshot = ChainSnapshot.from_dict(ChainSnapshot(contracts).to_dict())
+
+    with profiler.phase("prep_reward"):
+        # Swaps are still quoted from the pools at the snapshot's block
+        disbursement = simulate_disbursement(coordinape_group_epoch, reward_in_usd, funding_method, snapshot, SwapQuoter(contracts))
+
+    with profiler.phase("safe_build"):
+        safe_txs = build_safe_txs(
+            disbursement.get_safe_tx_groups(), snapshot.safe_address, contracts.safe.pending_nonce(), contracts.chain_id, contracts.safe.retrieve_version()
+        )
+        save_safe_txs(safe_txs, SAFE_TX_OUTPUT_FORMAT.format(group.name, epoch))
+        ape_safe_txs = [(contracts, to_ape_safe_tx(contracts.safe, safe_tx)) for safe_tx in safe_txs]
+
+    with profiler.phase("report"):
+        table = make_table(coordinape_group_epoch, disbursement.contributors, disbursement.amounts, snapshot.yfi_decimal_multiplicand, disbursement.yfi_in_usd, snapshot.price_per_share, coordinape_group_epoch.get_total_votes())
+    print(
+        f"{group.name} epoch #{epoch}\nDistributing ${reward_in_usd}\nYFI price ${disbursement.yfi_in_usd}\nyvYFI price per share {snapshot.price_per_share}\n"
+    )
+    for safe_tx in safe_txs:
+        print(f"Safe tx hash {safe_tx.safe_tx_hash} (nonce {safe_tx.nonce})")
+    print(table)
+
+    post_safe_transactions(ape_safe_txs, verify)
+    finish_profiler(profiler, f"{group.name}_{epoch}")
+    return safe_txs
 
 
 def disperse_yearn_community_epoch_3():
@@ -201,16 +366,38 @@ def disperse_strategist_6():
     disperse(CoordinapeGroup.YSTRATEGIST, 6, BRAIN_YCHAD_ETH, FundingMethod.TRANSFER_YVYFI)
 
 
-def disperse_strategist_7():
-    contracts = Contracts(BRAIN_YCHAD_ETH)
+def raise_yvyfi_deposit_limit(contracts):
     contracts.yvyfi.setDepositLimit(contracts.yvyfi.depositLimit() * 3)
-    disperse(CoordinapeGroup.YSTRATEGIST, 7, BRAIN_YCHAD_ETH, FundingMethod.DEPOSIT_ALL_YFI_TO_YVYFI)
+
+
+def disperse_strategist_7():
+    disperse_batch(
+        [
+            DisperseJob(
+                CoordinapeGroup.YSTRATEGIST,
+                7,
+                BRAIN_YCHAD_ETH,
+                FundingMethod.DEPOSIT_ALL_YFI_TO_YVYFI,
+                setup=raise_yvyfi_deposit_limit,
+            )
+        ]
+    )
 
 
 def disperse_strategist_8():
     disperse(CoordinapeGroup.YSTRATEGIST, 8, BRAIN_YCHAD_ETH, FundingMethod.TRANSFER_YVYFI)
 
 
+# Example of catching up on several epochs in one session, one multisend per safe
+def disperse_all_latest_epochs():
+    disperse_batch(
+        [
+            DisperseJob(CoordinapeGroup.COMMUNITY, 9, YCHAD_ETH, FundingMethod.DEPOSIT_YFI),
+            DisperseJob(CoordinapeGroup.YSTRATEGIST, 8, BRAIN_YCHAD_ETH, FundingMethod.TRANSFER_YVYFI),
+        ]
+    )
+
+
 if __name__ == "__main__":
     network.connect("mainnet-fork")
     disperse_yearn_community_epoch_9()
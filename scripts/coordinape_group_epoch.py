@@ -1,53 +1,74 @@
 from scripts.constants import *
 from scripts.configuration import *
 from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
-import requests
-import io
-import csv
+from scripts.contributor_table import ContributorTable, load_exclusion_list, normalize_address
+from scripts.epoch_results_fetcher import EpochResultsFetcher
+import pathlib
 
 class CoordinapeGroupEpoch:
-    def __init__(self, group, epoch, exclusion_list, exclusion_type):
+    # exclusion_list is a list of addresses or the path of a file with one address per line
+    def __init__(self, group, epoch, exclusion_list, exclusion_type, fetcher=None):
         self.group = group
         self.epoch = epoch
-        self.exclusion_list = exclusion_list
+        if isinstance(exclusion_list, (str, pathlib.Path)):
+            self.exclusion_list = load_exclusion_list(exclusion_list)
+        else:
+            self.exclusion_list = {normalize_address(address) for address in exclusion_list}
         self.exclusion_type = exclusion_type
+        self.fetcher = EpochResultsFetcher() if fetcher is None else fetcher
+        self.contributors = None
+        self.rewarded_contributors = None
+        self.rewarded_contributors_key = None
 
 
+    def get_epoch_results_csv(self):
+        return self.fetcher.fetch(self.group, self.epoch)
+
+
+    # Results are fetched once per group/epoch and kept in memory after that
     def get_contributors_from_epoch(self):
-        endpoint = EPOCH_RESULTS_ENDPOINT_FORMAT.format(self.group.value, self.epoch)
-        r = requests.get(endpoint)
-        buff = io.StringIO(r.text)
-        return list(csv.DictReader(buff))
+        if self.contributors is None:
+            self.contributors = ContributorTable.from_csv(self.get_epoch_results_csv())
+        return self.contributors
+
 
+    # Drop both the in memory and on disk results so the next call re-downloads them
+    def invalidate_cache(self):
+        self.contributors = None
+        self.rewarded_contributors = None
+        self.fetcher.cache.invalidate(self.group, self.epoch)
 
-    def get_reward_in_usd(self):
+
+    # Leftovers in LEFTOVER_DICT win, otherwise they're worked out from the disbursement index if given
+    def get_reward_in_usd(self, disbursement_index=None):
+        if disbursement_index is not None:
+            return disbursement_index.get_reward_in_usd(self.group, self.epoch)
         reward_in_usd = DEFAULT_USD_REWARD_DICT[self.group][self.epoch]
         if self.group in LEFTOVER_DICT and self.epoch - 1 in LEFTOVER_DICT[self.group]:
             reward_in_usd += LEFTOVER_DICT[self.group][self.epoch - 1]
         return reward_in_usd
 
 
+    def is_excluded(self, address):
+        return normalize_address(address) in self.exclusion_list
+
+
+    # Kept in memory for the current exclusion settings, changing exclusion_type or
+    # exclusion_list afterwards recomputes it
     def get_rewarded_contributors_this_epoch(self):
-        rewarded_contributors_this_epoch = [
-            contributor
-            for contributor in self.get_contributors_from_epoch()
-            if int(contributor["received"]) > 0
-        ]
+        key = (self.exclusion_type, frozenset(self.exclusion_list))
+        if self.rewarded_contributors is None or self.rewarded_contributors_key != key:
+            rewarded_contributors_this_epoch = self.get_contributors_from_epoch().with_votes()
 
-        # REDISTRIBUTE_SHARE means we will treat excluded folks as never being in the pool
-        # and their share will be distributed to others based on the other votes
-        if self.exclusion_type == ExclusionMethod.REDISTRIBUTE_SHARE:
-            rewarded_contributors_this_epoch = [
-                contributor
-                for contributor in rewarded_contributors_this_epoch
-                if contributor["address"] not in self.exclusion_list
-            ]
+            # REDISTRIBUTE_SHARE means we will treat excluded folks as never being in the pool
+            # and their share will be distributed to others based on the other votes
+            if self.exclusion_type == ExclusionMethod.REDISTRIBUTE_SHARE:
+                rewarded_contributors_this_epoch = rewarded_contributors_this_epoch.without(self.exclusion_list)
 
-        return rewarded_contributors_this_epoch
+            self.rewarded_contributors = rewarded_contributors_this_epoch
+            self.rewarded_contributors_key = key
+        return self.rewarded_contributors
 
 
     def get_total_votes(self):
-        total_votes = 0
-        for contributor in self.get_rewarded_contributors_this_epoch():
-            total_votes += int(contributor["received"])
-        return total_votes
\ No newline at end of file
+        return self.get_rewarded_contributors_this_epoch().total_votes
@@ -1,102 +1,176 @@
 from scripts.constants import *
 from scripts.configuration import *
 from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
-from fractions import Fraction
-from pytest import approx
-import math
-from brownie import *
+from scripts.allocation import allocate
+from scripts.chain_snapshot import ChainSnapshot
+from scripts.swap_quote import SwapLeg, SwapQuoter
+from scripts.disperse_chunks import plan_disperse_chunks
+from scripts.safe_tx import check_planned_tx_args
+from scripts.tolerance import is_close
+from collections import namedtuple
+import time
+
+# A contract call made while funding or dispersing, contract is the attribute name on Contracts.
+# expected_amount_out is what a swap is quoted to return, for the offline simulation.
+PlannedTx = namedtuple("PlannedTx", ["contract", "method", "args", "expected_amount_out"], defaults=[None])
 
 
 class Disbursement:
-    def __init__(self, reward_in_usd, funding_method, contracts, buffer):
+    # swap_quoter prices MARKET_BUY swaps from the pools, by default it's made from contracts.
+    # Pass one to simulate offline against a snapshot but still quote from the live pools.
+    def __init__(self, reward_in_usd, funding_method, contracts, buffer, snapshot=None, swap_quoter=None):
         self.reward_in_usd = reward_in_usd
         self.funding_method = funding_method
         self.contracts = contracts
         self.buffer = buffer
-        self.yfi_in_usd = self.contracts.yfi_usd_oracle.latestAnswer() / 10 ** self.contracts.yfi_usd_oracle.decimals()
-        self.yfi_allocated = (self.reward_in_usd / self.yfi_in_usd) * self.contracts.yfi_decimal_multiplicand
-        self.yvyfi_before = self.contracts.yvyfi.balanceOf(self.contracts.safe.account)
-        self.treasury_yvyfi_before = self.contracts.yvyfi.balanceOf(self.contracts.treasury)
-        self.yfi_before =  self.contracts.yfi.balanceOf(self.contracts.safe.account)
-        self.yvyfi_ratio = self.contracts.yvyfi.totalAssets() / self.contracts.yvyfi.totalSupply()
-        self.yvyfi_to_disperse = Wei((self.yfi_allocated *  self.contracts.yvyfi.totalSupply()) /  self.contracts.yvyfi.totalAssets())
+        self.swap_quoter = SwapQuoter(contracts) if swap_quoter is None and contracts is not None else swap_quoter
+        self.snapshot = ChainSnapshot(contracts) if snapshot is None else snapshot
+        self.yfi_in_usd = self.snapshot.yfi_in_usd
+        self.yfi_allocated = (self.reward_in_usd / self.yfi_in_usd) * self.snapshot.yfi_decimal_multiplicand
+        self.yvyfi_before = self.snapshot.safe_yvyfi
+        self.treasury_yvyfi_before = self.snapshot.treasury_yvyfi
+        self.yfi_before = self.snapshot.safe_yfi
+        self.yvyfi_ratio = self.snapshot.yvyfi_ratio
+        self.yvyfi_to_disperse = int((self.yfi_allocated * self.snapshot.yvyfi_total_supply) / self.snapshot.yvyfi_total_assets)
         self.amounts = None
+        self.contributors = None
         self.yvyfi_removed_by_exclusion = None
+        self.disperse_chunks = None
         self.yfi_to_deposit = self.yfi_allocated
         self.yvyfi_to_transfer = self.yvyfi_to_disperse
+        self.planned_txs = []
+        self.receipts = []
+        self.safe_tx_starts = [0]
+
+
+    # Sends the call through the safe, or without contracts simulates it against the offline snapshot
+    def execute(self, contract, method, *args, expected_amount_out=None):
+        planned_tx = PlannedTx(contract, method, args, expected_amount_out)
+        check_planned_tx_args(planned_tx)
+        self.planned_txs.append(planned_tx)
+        if self.contracts is None:
+            self.snapshot.apply(planned_tx)
+        else:
+            start = time.perf_counter()
+            tx = getattr(getattr(self.contracts, contract), method)(*args)
+            self.contracts.profiler.record_call(f"{contract}.{method}", time.perf_counter() - start, getattr(tx, "gas_used", None))
+            self.receipts.append(tx)
+        return planned_tx
+
+
+    # Calls executed from here on go into the next safe transaction
+    def start_safe_tx(self):
+        self.safe_tx_starts.append(len(self.planned_txs))
+
+
+    # Splits planned_txs, or receipts, into one list per safe transaction
+    def get_safe_tx_groups(self, items=None):
+        items = self.planned_txs if items is None else items
+        ends = self.safe_tx_starts[1:] + [len(items)]
+        return [items[start:end] for start, end in zip(self.safe_tx_starts, ends)]
 
 
     def needs_yvyfi(self):
-        return self.yvyfi_before / self.yvyfi_to_disperse < EXPECTED_YVYFI_BUFFER
+        return self.yvyfi_before / self.yvyfi_to_disperse < self.buffer
 
 
     def needs_yfi(self):
-        return self.yfi_before / self.yfi_allocated < EXPECTED_YVYFI_BUFFER
+        return self.yfi_before / self.yfi_allocated < self.buffer
+
+
+    # Best route/split for the swap from the pool reserves, each leg's minimum out SWAP_SLIPPAGE below
+    # its quote. Without a quoter there are no reserves, so the default route is used and the oracle
+    # price stands in for the quote.
+    def get_swap_legs(self, usdc_to_swap):
+        expected_yfi = usdc_to_swap / self.snapshot.usdc_decimal_multiplicand / self.yfi_in_usd * self.snapshot.yfi_decimal_multiplicand
+        if self.swap_quoter is None:
+            return [SwapLeg(SWAP_ROUTES[0], usdc_to_swap, int(expected_yfi), int(expected_yfi * (1 - SWAP_SLIPPAGE)))]
+        quote = self.swap_quoter.quote(usdc_to_swap, self.snapshot.block)
+        assert (
+            quote.amount_out >= expected_yfi * (1 - SWAP_ORACLE_TOLERANCE)
+        ), f"The pools quote {quote.amount_out} YFI, more than {SWAP_ORACLE_TOLERANCE:0.0%} below the oracle's {int(expected_yfi)}"
+        return quote.legs
 
 
     # After this, treasury should have enough yvYFI
     def market_buy(self):
-        # do market buy
-        usdc_to_swap = self.reward_in_usd * 10 ** self.contracts.usdc.decimals()
-        usdc_balance = self.contracts.usdc.balanceOf(self.contracts.safe.account)
+        # do market buy, for the reward left after any removed shares
+        usd_to_swap = self.yfi_allocated / self.snapshot.yfi_decimal_multiplicand * self.yfi_in_usd
+        usdc_to_swap = usd_to_swap * self.snapshot.usdc_decimal_multiplicand
+        if self.needs_yfi() and self.needs_yvyfi():
+            usdc_to_swap += self.buffer * usdc_to_swap * self.yvyfi_ratio
+        usdc_to_swap = int(usdc_to_swap)
+
+        # Pull what's missing for the whole swap, buffer included
+        usdc_balance = self.snapshot.safe_usdc
         if usdc_balance < usdc_to_swap:
             usdc_need = usdc_to_swap - usdc_balance
-            assert self.contracts.treasury.governance() == self.contracts.safe.account
-            assert self.contracts.usdc.balanceOf(self.contracts.treasury) >= usdc_need
-            self.contracts.treasury.toGovernance(self.contracts.usdc, usdc_need)
+            assert self.snapshot.safe_is_treasury_governance
+            assert self.snapshot.treasury_usdc >= usdc_need
+            self.execute("treasury", "toGovernance", USDC_ADDRESS, int(usdc_need))
 
-        if self.needs_yfi() and self.needs_yvyfi():
-            usdc_to_swap += EXPECTED_YVYFI_BUFFER * usdc_to_swap * self.yvyfi_ratio
-
-        self.contracts.usdc.approve(self.contracts.sushiswap, usdc_to_swap)
-        self.contracts.sushiswap.swapExactTokensForTokens(usdc_to_swap, 0, [self.contracts.usdc, self.contracts.weth, self.contracts.yfi], self.contracts.safe.account, 2**256-1)
-        self.yfi_in_usd = self.reward_in_usd / (self.yfi_allocated / self.contracts.yfi_decimal_multiplicand)
-        self.yfi_before = self.contracts.yfi.balanceOf(self.contracts.safe.account)
+        self.execute("usdc", "approve", SUSHISWAP_ADDRESS, usdc_to_swap)
+        deadline = int(time.time()) + SWAP_DEADLINE_HOURS * 60 * 60
+        for swap_leg in self.get_swap_legs(usdc_to_swap):
+            self.execute(
+                "sushiswap",
+                "swapExactTokensForTokens",
+                swap_leg.amount_in,
+                swap_leg.amount_out_min,
+                swap_leg.path,
+                self.snapshot.safe_address,
+                deadline,
+                expected_amount_out=swap_leg.amount_out,
+            )
+        self.yfi_in_usd = usd_to_swap / (self.yfi_allocated / self.snapshot.yfi_decimal_multiplicand)
+        self.snapshot.refresh()
+        self.yfi_before = self.snapshot.safe_yfi
         self.deposit_yfi()
 
 
     def transfer_yfi_from_treasury(self):
-        assert self.contracts.treasury.governance() == self.contracts.safe.account
+        assert self.snapshot.safe_is_treasury_governance
 
         yfi_to_transfer = self.yfi_allocated
         if self.needs_yfi() and self.needs_yvyfi():
-            yfi_to_transfer += self.yfi_allocated * EXPECTED_YVYFI_BUFFER * self.yvyfi_ratio
+            yfi_to_transfer += self.yfi_allocated * self.buffer * self.yvyfi_ratio
 
-        assert self.contracts.yfi.balanceOf(self.contracts.treasury) >= yfi_to_transfer
-        self.contracts.treasury.toGovernance(self.contracts.yfi, yfi_to_transfer)
-        self.yfi_before = self.contracts.yfi.balanceOf(self.contracts.safe.account)
+        assert self.snapshot.treasury_yfi >= yfi_to_transfer
+        self.execute("treasury", "toGovernance", YFI_ADDRESS, int(yfi_to_transfer))
+        self.snapshot.refresh()
+        self.yfi_before = self.snapshot.safe_yfi
         self.deposit_yfi()
 
 
     def deposit_yfi(self):
-        safe_yfi_balance = self.contracts.yfi.balanceOf(self.contracts.safe.account)
-        safe_yvyfi_balance = self.contracts.yvyfi.balanceOf(self.contracts.safe.account)
         if self.needs_yvyfi():
-            self.yfi_to_deposit += self.yfi_to_deposit * EXPECTED_YVYFI_BUFFER * self.yvyfi_ratio
+            self.yfi_to_deposit += self.yfi_to_deposit * self.buffer * self.yvyfi_ratio
 
-        assert safe_yfi_balance >= self.yfi_to_deposit
-        self.contracts.yfi.approve(self.contracts.yvyfi, self.yfi_to_deposit)
-        self.contracts.yvyfi.deposit(self.yfi_to_deposit)
+        assert self.snapshot.safe_yfi >= self.yfi_to_deposit, f"The safe only has {self.snapshot.safe_yfi} YFI, {int(self.yfi_to_deposit)} is needed for the deposit"
+        self.execute("yfi", "approve", YEARN_VAULT_YFI_ADDRESS, int(self.yfi_to_deposit))
+        self.execute("yvyfi", "deposit", int(self.yfi_to_deposit))
 
 
     def deposit_all_yfi_to_yvyfi(self):
-        yfi_balance = self.contracts.yfi.balanceOf(self.contracts.safe.account)
-        self.contracts.yfi.approve(self.contracts.yvyfi, yfi_balance)
-        self.contracts.yvyfi.deposit(yfi_balance)
-        assert self.yvyfi_to_disperse <= self.contracts.yvyfi.balanceOf(self.contracts.safe.account)
+        yfi_balance = self.snapshot.safe_yfi
+        self.execute("yfi", "approve", YEARN_VAULT_YFI_ADDRESS, yfi_balance)
+        self.execute("yvyfi", "deposit", yfi_balance)
 
 
     def transfer_yvyfi_from_treasury(self):
-        self.contracts.treasury = self.contracts.safe.contract(YEARN_TREASURY_ADDRESS)
-        assert self.contracts.treasury.governance() == self.contracts.safe.account
+        assert self.snapshot.safe_is_treasury_governance
         self.yvyfi_to_transfer = self.yvyfi_to_disperse
         if self.needs_yvyfi():
-            self.yvyfi_to_transfer += self.yvyfi_to_transfer * EXPECTED_YVYFI_BUFFER
-        assert self.contracts.yvyfi.balanceOf(self.contracts.treasury) >= self.yvyfi_to_transfer
-        self.contracts.treasury.toGovernance(self.contracts.yvyfi, self.yvyfi_to_transfer)
+            self.yvyfi_to_transfer += self.yvyfi_to_transfer * self.buffer
+        assert self.snapshot.treasury_yvyfi >= self.yvyfi_to_transfer
+        self.execute("treasury", "toGovernance", YEARN_VAULT_YFI_ADDRESS, int(self.yvyfi_to_transfer))
 
 
+    # Funds what get_amounts left to disperse, so REMOVE_SHARE exclusions aren't funded
     def prep_reward(self):
+        assert self.amounts is not None, "Call get_amounts before prep_reward, it decides how much needs funding"
+        self.yfi_to_deposit = self.yfi_allocated
+        self.yvyfi_to_transfer = self.yvyfi_to_disperse
         if self.funding_method == FundingMethod.MARKET_BUY:
             self.market_buy()
         elif self.funding_method == FundingMethod.TRANSFER_YFI_FROM_TREASURY:
@@ -107,83 +181,84 @@ class Disbursement:
             self.deposit_all_yfi_to_yvyfi()
         elif self.funding_method == FundingMethod.TRANSFER_YVYFI_FROM_TREASURY:
             self.transfer_yvyfi_from_treasury()
-        
+
+        self.snapshot.refresh()
         self.check_buffer()
     
     def check_buffer(self):
+        safe_yvyfi = self.snapshot.safe_yvyfi
+        assert self.yvyfi_to_disperse <= safe_yvyfi, f"The safe only has {safe_yvyfi} yvYFI, {self.yvyfi_to_disperse} is needed"
+
         # Make sure we have a buffer of yvyfi to avoid some errors
         percentage_yvyfi_buffer = (
-            self.contracts.yvyfi.balanceOf(self.contracts.safe.account) - self.yvyfi_to_disperse
+            safe_yvyfi - self.yvyfi_to_disperse
         ) / self.yvyfi_to_disperse
 
         assert (
-            percentage_yvyfi_buffer >= EXPECTED_YVYFI_BUFFER
+            percentage_yvyfi_buffer >= self.buffer
             ), f"This TX could fail if yvYFI's pricePerShare changes before execution.\nThe yvyfi buffer is only {percentage_yvyfi_buffer}%\n"
     
+    # One safe transaction per chunk, each with its own approve and disperseToken, so none of
+    # them gets near the block gas limit. The first chunk goes out with the funding calls.
+    # balances are the recipients' yvYFI balances, used to estimate the gas, see plan_disperse_chunks.
+    def disperse_reward(self, recipients, balances=None, gas_cap=DISPERSE_CHUNK_GAS_CAP):
+        assert len(recipients) == len(self.amounts)
+        first_chunk_reserved_gas = FUNDING_GAS if len(self.planned_txs) > 0 else 0
+        self.disperse_chunks = plan_disperse_chunks(len(recipients), balances, gas_cap, first_chunk_reserved_gas)
+        for i, chunk in enumerate(self.disperse_chunks):
+            if i > 0:
+                self.start_safe_tx()
+            if len(chunk.indices) == 0:
+                continue
+            chunk_amounts = [self.amounts[j] for j in chunk.indices]
+            if self.contracts is not None:
+                self.snapshot.refresh()
+            assert self.snapshot.safe_yvyfi >= sum(chunk_amounts), f"The safe only has {self.snapshot.safe_yvyfi} yvYFI for chunk #{i}, {sum(chunk_amounts)} is needed"
+            self.execute("yvyfi", "approve", DISPERSE_APP_ADDRESS, sum(chunk_amounts))
+            self.execute("disperse", "disperseToken", YEARN_VAULT_YFI_ADDRESS, [recipients[j] for j in chunk.indices], chunk_amounts)
+
     def check_asserts(self):
+        self.snapshot.refresh()
+        yvyfi_after = self.snapshot.safe_yvyfi
+        yfi_after = self.snapshot.safe_yfi
+        treasury_yvyfi_after = self.snapshot.treasury_yvyfi
         if self.funding_method == FundingMethod.DEPOSIT_YFI or self.funding_method == FundingMethod.TRANSFER_YFI_FROM_TREASURY or self.funding_method == FundingMethod.MARKET_BUY:
             # we should have the yvyfi we had before plus any extra after we dispersed
             yvyfi_approx_after = self.yvyfi_before + (self.yfi_to_deposit / self.yvyfi_ratio - self.yvyfi_to_disperse)
             # Make sure we sent all the new yvYFI and only used as much YFI as expected
-            assert float(self.contracts.yvyfi.balanceOf(self.contracts.safe.account)) == approx(yvyfi_approx_after, 0.0001)
-            assert float(self.yfi_before - self.yfi_to_deposit) == approx(self.contracts.yfi.balanceOf(self.contracts.safe.account), 0.0001)
+            assert is_close(float(yvyfi_after), yvyfi_approx_after, 0.0001)
+            assert is_close(float(self.yfi_before - self.yfi_to_deposit), yfi_after, 0.0001)
         elif self.funding_method == FundingMethod.TRANSFER_YVYFI:
             # Make sure we didn't use YFI for some reason and only used as much yvYFI as expected
-            assert self.yfi_before == self.contracts.yfi.balanceOf(self.contracts.safe.account)
-            assert self.yvyfi_before - self.yvyfi_to_disperse == self.contracts.yvyfi.balanceOf(self.contracts.safe.account)
+            assert self.yfi_before == yfi_after
+            assert self.yvyfi_before - self.yvyfi_to_disperse == yvyfi_after
         elif self.funding_method == FundingMethod.TRANSFER_YVYFI_FROM_TREASURY:
-            # Make sure we didn't use YFI and only used the yvYFI from the treasury
-            assert self.yfi_before == self.contracts.yfi.balanceOf(self.contracts.safe.account)
-            assert self.yvyfi_before == self.contracts.yvyfi.balanceOf(
-                self.contracts.safe.account
-            )
+            # Make sure we didn't use YFI and only used the yvYFI from the treasury, the safe keeps any buffer
+            assert self.yfi_before == yfi_after
+            assert self.yvyfi_before + int(self.yvyfi_to_transfer) - self.yvyfi_to_disperse == yvyfi_after
             assert self.treasury_yvyfi_before - (
-                self.yvyfi_to_disperse
-            ) == self.contracts.yvyfi.balanceOf(self.contracts.treasury)
+                int(self.yvyfi_to_transfer)
+            ) == treasury_yvyfi_after
     
     def get_amounts(self, coordinape_group_epoch):
-        # Converting here will leave some dust
         rewarded_contributors_this_epoch = coordinape_group_epoch.get_rewarded_contributors_this_epoch()
-        self.amounts = [
-            Wei(
-                self.yvyfi_to_disperse
-                * (Fraction(contributor["received"]) / Fraction(coordinape_group_epoch.get_total_votes()))
-            )
-            for contributor in rewarded_contributors_this_epoch
-        ]
+        excluded_indices = rewarded_contributors_this_epoch.find_all(coordinape_group_epoch.exclusion_list)
+        self.amounts, kept_indices, self.yvyfi_removed_by_exclusion = allocate(
+            rewarded_contributors_this_epoch.votes, self.yvyfi_to_disperse, excluded_indices, coordinape_group_epoch.exclusion_type
+        )
+        self.contributors = rewarded_contributors_this_epoch.select(kept_indices)
 
         # REMOVE_SHARE means we will remove the excluded
         # contributors and not distribute their share. Subtract their
         # amount from the yvyfi to disperse.
-        self.yvyfi_removed_by_exclusion = 0
-        if coordinape_group_epoch.exclusion_type == ExclusionMethod.REMOVE_SHARE:
-            for contributor_address in coordinape_group_epoch.exclusion_list:
-                contributor_to_exclude = next(
-                    x
-                    for x in rewarded_contributors_this_epoch
-                    if x["address"] == contributor_address
-                )
-                index = rewarded_contributors_this_epoch.index(contributor_to_exclude)
-                del rewarded_contributors_this_epoch[index]
-                self.yvyfi_removed_by_exclusion += self.amounts[index]
-                self.yvyfi_to_disperse -= self.amounts[index]
-                yfi_allocated -= self.amounts[index] * (
-                    self.contracts.yvyfi.totalAssets() / self.contracts.yvyfi.yvyfi.totalSupply()
-                )
-                del self.amounts[index]
-
-        # Dust should be less than or equal to 1 Wei per contributor due to the previous floor
-        dust = self.yvyfi_to_disperse - sum(self.amounts)
-        assert dust <= len(coordinape_group_epoch.get_rewarded_contributors_this_epoch())
-
-        # Some lucky folks can get some dust, woot
-        for i in range(math.floor(dust)):
-            self.amounts[i] += 1
+        self.yvyfi_to_disperse -= self.yvyfi_removed_by_exclusion
+        self.yfi_allocated -= self.yvyfi_removed_by_exclusion * self.yvyfi_ratio
 
         assert sum(self.amounts) == self.yvyfi_to_disperse
-        assert float(self.yfi_allocated) == approx(
-            self.yvyfi_to_disperse * (self.contracts.yvyfi.totalAssets() / self.contracts.yvyfi.totalSupply()),
-            Wei("0.000001 ether") / self.contracts.yfi_decimal_multiplicand,
+        assert is_close(
+            float(self.yfi_allocated),
+            self.yvyfi_to_disperse * self.yvyfi_ratio,
+            10 ** 12 / self.snapshot.yfi_decimal_multiplicand,
         )
 
-        return self.amounts
\ No newline at end of file
+        return self.amounts
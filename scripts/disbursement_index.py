@@ -0,0 +1,414 @@
+import json
+import sqlite3
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from scripts.constants import *
+from scripts.configuration import *
+from scripts.coordinape_enums import CoordinapeGroup
+from scripts.tolerance import is_close
+
+INDEXED_TOKENS = {
+    YEARN_VAULT_YFI_ADDRESS.lower(): 18,
+    USDC_ADDRESS.lower(): 6,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS disperses (
+    tx_hash TEXT PRIMARY KEY,
+    block INTEGER NOT NULL,
+    safe TEXT NOT NULL,
+    token TEXT NOT NULL,
+    total TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payouts (
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    tx_hash TEXT PRIMARY KEY,
+    group_name TEXT NOT NULL,
+    epoch INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS disperses_block ON disperses (block);
+CREATE INDEX IF NOT EXISTS payouts_recipient ON payouts (recipient);
+CREATE INDEX IF NOT EXISTS epochs_group_epoch ON epochs (group_name, epoch);
+"""
+
+
+def to_topic(address):
+    return "0x" + "0" * 24 + address.lower()[2:]
+
+
+def from_topic(topic):
+    return "0x" + topic[-40:].lower()
+
+
+# Reads logs and receipts from the connected node through web3, as plain dicts with hex strings
+class Web3Node:
+    def __init__(self, web3):
+        self.web3 = web3
+
+
+    @staticmethod
+    def normalize_log(log):
+        return {
+            "address": log["address"].lower(),
+            "topics": [topic.hex() if not isinstance(topic, str) else topic for topic in log["topics"]],
+            "data": log["data"] if isinstance(log["data"], str) else log["data"].hex(),
+            "blockNumber": log["blockNumber"],
+            "transactionHash": log["transactionHash"].hex() if not isinstance(log["transactionHash"], str) else log["transactionHash"],
+            "logIndex": log["logIndex"],
+        }
+
+
+    def get_block_number(self):
+        return self.web3.eth.block_number
+
+
+    def get_logs(self, filter_params):
+        return [self.normalize_log(log) for log in self.web3.eth.get_logs(filter_params)]
+
+
+    def get_receipt_logs(self, tx_hash):
+        return [self.normalize_log(log) for log in self.web3.eth.get_transaction_receipt(tx_hash)["logs"]]
+
+
+FIXTURE_PATH = pathlib.Path(__file__).parent / "fixtures" / "disbursement_index.json"
+
+
+# Serves logs recorded from a node, {"block_number": n, "logs": [...], "receipts": {tx_hash: [logs]}},
+# with the same interface as Web3Node so the indexer can run without a node
+class FixtureNode:
+    def __init__(self, path):
+        with open(path) as fixture_file:
+            fixture = json.load(fixture_file)
+        self.block_number = fixture["block_number"]
+        self.logs = fixture["logs"]
+        self.receipts = fixture["receipts"]
+
+
+    def get_block_number(self):
+        return self.block_number
+
+
+    @staticmethod
+    def matches(log, filter_params):
+        addresses = filter_params["address"]
+        addresses = [addresses] if isinstance(addresses, str) else addresses
+        if log["address"].lower() not in [address.lower() for address in addresses]:
+            return False
+        if not filter_params["fromBlock"] <= log["blockNumber"] <= filter_params["toBlock"]:
+            return False
+        for wanted, topic in zip(filter_params.get("topics", []), log["topics"]):
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            if topic.lower() not in [value.lower() for value in wanted]:
+                return False
+        return True
+
+
+    def get_logs(self, filter_params):
+        return [log for log in self.logs if self.matches(log, filter_params)]
+
+
+    def get_receipt_logs(self, tx_hash):
+        return self.receipts.get(tx_hash, [])
+
+
+# Local SQLite index of the yvYFI/USDC payouts our safes made through disperse.app.
+# Safe -> disperse Transfer logs are scanned in chunked eth_getLogs block ranges, the
+# recipient transfers come from those transactions' receipts, and indexing resumes
+# from the last indexed block. Disperse transactions are tied to a group/epoch from the
+# epoch results by label_epochs_from_results, or by hand with label_epoch or DISPERSE_TX_DICT.
+class DisbursementIndex:
+    def __init__(self, path=DISBURSEMENT_INDEX_PATH, node=None, usd_price=None):
+        if path != ":memory:":
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.node = node
+        # usd_price(token, block) returns the usd value of one whole token at that block, or None
+        self.usd_price = usd_price
+        self.label_configured_epochs()
+
+
+    def get_last_indexed_block(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_indexed_block'").fetchone()
+        return None if row is None else int(row[0])
+
+
+    def label_epoch(self, tx_hash, group, epoch):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO epochs (tx_hash, group_name, epoch) VALUES (?, ?, ?)",
+                (tx_hash.lower(), group.name, epoch),
+            )
+
+
+    def label_configured_epochs(self):
+        for group, tx_hashes in DISPERSE_TX_DICT.items():
+            for epoch, tx_hash in tx_hashes.items():
+                self.label_epoch(tx_hash, group, epoch)
+
+
+    # Shrinks the block range when the node refuses a query for returning too many logs
+    def get_logs_chunked(self, filter_params, from_block, to_block, chunk_size):
+        logs = []
+        start = from_block
+        while start <= to_block:
+            end = min(start + chunk_size - 1, to_block)
+            try:
+                logs.extend(self.node.get_logs(dict(filter_params, fromBlock=start, toBlock=end)))
+            except ValueError:
+                if end == start:
+                    raise
+                chunk_size = max(1, chunk_size // 2)
+                continue
+            start = end + 1
+        return logs
+
+
+    def index(self, safe_addresses, to_block=None, chunk_size=DISBURSEMENT_INDEX_BLOCK_CHUNK):
+        last_indexed_block = self.get_last_indexed_block()
+        from_block = DISBURSEMENT_INDEX_START_BLOCK if last_indexed_block is None else last_indexed_block + 1
+        if to_block is None:
+            to_block = self.node.get_block_number()
+        if from_block > to_block:
+            return 0
+
+        filter_params = {
+            "address": list(INDEXED_TOKENS),
+            "topics": [
+                TRANSFER_TOPIC,
+                [to_topic(address) for address in safe_addresses],
+                to_topic(DISPERSE_APP_ADDRESS),
+            ],
+        }
+        disperse_logs = self.get_logs_chunked(filter_params, from_block, to_block, chunk_size)
+
+        with self.db:
+            for log in disperse_logs:
+                self.index_disperse(log)
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_indexed_block', ?)", (str(to_block),)
+            )
+        return len(disperse_logs)
+
+
+    def index_disperse(self, disperse_log):
+        tx_hash = disperse_log["transactionHash"].lower()
+        token = disperse_log["address"].lower()
+        self.db.execute(
+            "INSERT OR REPLACE INTO disperses (tx_hash, block, safe, token, total) VALUES (?, ?, ?, ?, ?)",
+            (tx_hash, disperse_log["blockNumber"], from_topic(disperse_log["topics"][1]), token, str(int(disperse_log["data"], 16))),
+        )
+        disperse_topic = to_topic(DISPERSE_APP_ADDRESS)
+        for log in self.node.get_receipt_logs(tx_hash):
+            topics = log["topics"]
+            if log["address"].lower() != token or len(topics) != 3 or topics[0] != TRANSFER_TOPIC:
+                continue
+            if topics[1].lower() != disperse_topic:
+                continue
+            self.db.execute(
+                "INSERT OR REPLACE INTO payouts (tx_hash, log_index, block, token, recipient, amount) VALUES (?, ?, ?, ?, ?, ?)",
+                (tx_hash, log["logIndex"], log["blockNumber"], token, from_topic(topics[2]), str(int(log["data"], 16))),
+            )
+
+
+    # Whether amounts, {recipient: amount}, pay these contributors in proportion to their votes
+    # to within a unit of rounding, which is how every disperse pays out its epoch
+    @staticmethod
+    def matches_votes(amounts, contributors):
+        indices = [contributors.find(recipient) for recipient in amounts]
+        if len(amounts) == 0 or None in indices:
+            return False
+        amount_per_vote = sum(amounts.values()) / sum(contributors.votes[i] for i in indices)
+        return all(
+            is_close(amount, contributors.votes[i] * amount_per_vote, 1e-6, 2)
+            for amount, i in zip(amounts.values(), indices)
+        )
+
+
+    def get_unlabeled_disperses(self):
+        return [
+            row[0]
+            for row in self.db.execute(
+                "SELECT d.tx_hash FROM disperses d LEFT JOIN epochs e ON d.tx_hash = e.tx_hash WHERE e.tx_hash IS NULL ORDER BY d.block"
+            )
+        ]
+
+
+    # Amount per recipient of a disperse transaction
+    def get_disperse_amounts(self, tx_hash):
+        amounts = {}
+        for recipient, amount in self.db.execute("SELECT recipient, amount FROM payouts WHERE tx_hash = ?", (tx_hash,)):
+            amounts[recipient] = amounts.get(recipient, 0) + int(amount)
+        return amounts
+
+
+    # Labels each unlabeled disperse with the one group/epoch whose results it pays out: every
+    # recipient has votes and got an amount proportional to them. A disperse that matches no
+    # epoch, or several, stays unlabeled. Returns how many were labeled.
+    def label_epochs_from_results(self, group_epochs=None, fetcher=None):
+        from scripts.contributor_table import ContributorTable
+        from scripts.epoch_results_fetcher import EpochResultsFetcher, get_configured_group_epochs
+
+        unlabeled = self.get_unlabeled_disperses()
+        if len(unlabeled) == 0:
+            return 0
+        group_epochs = get_configured_group_epochs() if group_epochs is None else group_epochs
+        fetcher = EpochResultsFetcher() if fetcher is None else fetcher
+        contributors = {
+            group_epoch: ContributorTable.from_csv(text).with_votes() for group_epoch, text in fetcher.fetch_many(group_epochs).items()
+        }
+
+        labeled = 0
+        for tx_hash in unlabeled:
+            amounts = self.get_disperse_amounts(tx_hash)
+            matches = [group_epoch for group_epoch, table in contributors.items() if self.matches_votes(amounts, table)]
+            if len(matches) == 1:
+                self.label_epoch(tx_hash, *matches[0])
+                labeled += 1
+        return labeled
+
+
+    def get_disperse_blocks(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT block FROM disperses ORDER BY block")]
+
+
+    def get_epoch_disperses(self, group, epoch):
+        return self.db.execute(
+            "SELECT d.tx_hash, d.block, d.token, d.total FROM disperses d JOIN epochs e ON d.tx_hash = e.tx_hash "
+            "WHERE e.group_name = ? AND e.epoch = ? ORDER BY d.block",
+            (group.name, epoch),
+        ).fetchall()
+
+
+    def get_payouts(self, group=None, epoch=None, recipient=None):
+        query = "SELECT p.tx_hash, p.block, p.token, p.recipient, p.amount FROM payouts p LEFT JOIN epochs e ON p.tx_hash = e.tx_hash WHERE 1 = 1"
+        params = []
+        if group is not None:
+            query += " AND e.group_name = ?"
+            params.append(group.name)
+        if epoch is not None:
+            query += " AND e.epoch = ?"
+            params.append(epoch)
+        if recipient is not None:
+            query += " AND p.recipient = ?"
+            params.append(recipient.lower())
+        return [
+            (tx_hash, block, token, recipient, int(amount))
+            for tx_hash, block, token, recipient, amount in self.db.execute(query + " ORDER BY p.block, p.log_index", params)
+        ]
+
+
+    def token_usd_value(self, token, block, amount):
+        if token == USDC_ADDRESS.lower():
+            return amount / 10 ** INDEXED_TOKENS[token]
+        price = None if self.usd_price is None else self.usd_price(token, block)
+        if price is None:
+            return None
+        return amount / 10 ** INDEXED_TOKENS[token] * price
+
+
+    # USD paid out for a group's epoch, None if no indexed disperse is labeled with it or it can't be priced
+    def get_paid_usd(self, group, epoch):
+        disperses = self.get_epoch_disperses(group, epoch)
+        if len(disperses) == 0:
+            return None
+        paid_usd = 0
+        for tx_hash, block, token, total in disperses:
+            usd_value = self.token_usd_value(token, block, int(total))
+            if usd_value is None:
+                return None
+            paid_usd += usd_value
+        return paid_usd
+
+
+    # An epoch's budget is its default reward plus what the epoch before left over, from
+    # LEFTOVER_DICT if it's there and otherwise from what was paid, going back epoch by epoch
+    def get_reward_in_usd(self, group, epoch):
+        reward_in_usd = DEFAULT_USD_REWARD_DICT[group][epoch]
+        if group in LEFTOVER_DICT and epoch - 1 in LEFTOVER_DICT[group]:
+            return reward_in_usd + LEFTOVER_DICT[group][epoch - 1]
+        return reward_in_usd + (self.get_leftover_usd(group, epoch - 1) or 0)
+
+
+    def get_leftover_usd(self, group, epoch):
+        if epoch not in DEFAULT_USD_REWARD_DICT.get(group, {}):
+            return None
+        paid_usd = self.get_paid_usd(group, epoch)
+        if paid_usd is None:
+            return None
+        return max(0, round(self.get_reward_in_usd(group, epoch) - paid_usd))
+
+
+# The index every run sizes its reward with, pricing past payouts from the local price series,
+# so disperse, plan, what_if and buffer_risk all work out the same leftovers
+def load_disbursement_index():
+    from scripts.price_series import PriceSeries
+
+    return DisbursementIndex(usd_price=PriceSeries().usd_price)
+
+
+# Brings the local index up to date from the connected network:
+# brownie run disbursement_index.py index_disbursements
+def index_disbursements():
+    from brownie import web3
+
+    safe_addresses = [web3.ens.resolve(name) for name in (YCHAD_ETH, BRAIN_YCHAD_ETH)]
+    disbursement_index = DisbursementIndex(node=Web3Node(web3))
+    found = disbursement_index.index(safe_addresses)
+    labeled = disbursement_index.label_epochs_from_results()
+    print(f"Indexed {found} disperse transactions up to block {disbursement_index.get_last_indexed_block()}, labeled {labeled} with their epoch")
+    return disbursement_index
+
+
+# Runs the indexer, epoch labeling and leftovers against the recorded fixture, no node needed:
+# python scripts/disbursement_index.py
+def check_fixture(path=FIXTURE_PATH):
+    import tempfile
+    from scripts.epoch_results_cache import EpochResultsCache
+    from scripts.epoch_results_fetcher import EpochResultsFetcher
+
+    with open(path) as fixture_file:
+        fixture = json.load(fixture_file)
+    disbursement_index = DisbursementIndex(":memory:", FixtureNode(path))
+
+    # Index up to the middle of the fixture, then resume from there
+    assert disbursement_index.index([fixture["safe"]], fixture["resume_block"]) == 1
+    assert disbursement_index.get_last_indexed_block() == fixture["resume_block"]
+    assert disbursement_index.index([fixture["safe"]]) == 1
+    assert disbursement_index.get_last_indexed_block() == fixture["block_number"]
+    assert disbursement_index.index([fixture["safe"]]) == 0
+    assert len(disbursement_index.get_payouts()) == 5
+
+    cache = EpochResultsCache(tempfile.mkdtemp())
+    group_epochs = []
+    for name, text in fixture["epoch_results"].items():
+        group_name, epoch = name.rsplit("_", 1)
+        group_epochs.append((CoordinapeGroup[group_name], int(epoch)))
+        cache.put(*group_epochs[-1], text)
+    assert disbursement_index.label_epochs_from_results(group_epochs, EpochResultsFetcher(cache)) == 2
+    for group_epoch, tx_hash in zip(group_epochs, fixture["disperse_tx_hashes"]):
+        assert [row[0] for row in disbursement_index.get_epoch_disperses(*group_epoch)] == [tx_hash]
+
+    # Epoch 2 paid 33,098 of 40,000. Epoch 3's budget was 40,000 plus those 6,902 and it paid
+    # 46,000, so epoch 4 gets 902 on top of its 60,000.
+    assert disbursement_index.get_leftover_usd(CoordinapeGroup.COMMUNITY, 2) == 6902
+    assert disbursement_index.get_reward_in_usd(CoordinapeGroup.COMMUNITY, 3) == 46902
+    assert disbursement_index.get_leftover_usd(CoordinapeGroup.COMMUNITY, 3) == 902
+    assert disbursement_index.get_reward_in_usd(CoordinapeGroup.COMMUNITY, 4) == 60902
+    print(f"{path} checks out")
+
+
+if __name__ == "__main__":
+    check_fixture()
@@ -0,0 +1,65 @@
+import heapq
+from collections import namedtuple
+from scripts.constants import *
+
+# indices are positions in the recipients/amounts lists, in their original order.
+# Each chunk is sent as its own safe transaction, gas is the estimate for all of it.
+DisperseChunk = namedtuple("DisperseChunk", ["indices", "gas"])
+
+
+# balances are the recipients' current yvYFI balances. Without them every recipient
+# is assumed to be a new holder, which overestimates the gas rather than underestimates it.
+def estimate_recipient_gas(recipient_count, balances=None):
+    if balances is None:
+        return [DISPERSE_GAS_PER_NEW_HOLDER] * recipient_count
+    assert len(balances) == recipient_count
+    return [DISPERSE_GAS_PER_HOLDER if balance > 0 else DISPERSE_GAS_PER_NEW_HOLDER for balance in balances]
+
+
+# Splits the recipients into as few safe transactions as fit under gas_cap each. A safe
+# multisend runs in a single ethereum transaction, so the cap covers the safe's own overhead,
+# the approve and disperseToken call and, for the first chunk, first_chunk_reserved_gas
+# for the funding calls that go out with it.
+# Starts from the fewest chunks the total gas allows and places the most expensive
+# recipients first, each into the chunk with the least gas so far, adding a chunk
+# if that doesn't fit. Ties go by position, so the same inputs always give the same
+# chunks. The first chunk is the one sent with the funding calls and may be empty if
+# they leave no room, the rest are ordered by their first recipient.
+def plan_disperse_chunks(recipient_count, balances=None, gas_cap=DISPERSE_CHUNK_GAS_CAP, first_chunk_reserved_gas=0):
+    if recipient_count == 0:
+        return []
+
+    recipient_gas = estimate_recipient_gas(recipient_count, balances)
+    chunk_base_gas = SAFE_TX_BASE_GAS + DISPERSE_BASE_GAS
+    capacity = gas_cap - chunk_base_gas
+    assert capacity >= max(recipient_gas), f"A gas cap of {gas_cap} can't fit a single recipient"
+
+    order = sorted(range(recipient_count), key=lambda i: (-recipient_gas[i], i))
+    chunk_count = max(-(-(sum(recipient_gas) + first_chunk_reserved_gas) // capacity), 1)
+    while True:
+        chunks = pack(order, recipient_gas, chunk_count, capacity, first_chunk_reserved_gas)
+        if chunks is not None:
+            break
+        chunk_count += 1
+
+    first_chunk = DisperseChunk(sorted(chunks[0]), chunk_base_gas + first_chunk_reserved_gas + sum(recipient_gas[i] for i in chunks[0]))
+    other_chunks = [
+        DisperseChunk(sorted(indices), chunk_base_gas + sum(recipient_gas[i] for i in indices))
+        for indices in chunks[1:]
+        if indices
+    ]
+    return [first_chunk] + sorted(other_chunks, key=lambda chunk: chunk.indices[0])
+
+
+# Least loaded chunk first, returns None if some recipient doesn't fit in chunk_count chunks
+def pack(order, recipient_gas, chunk_count, capacity, first_chunk_reserved_gas):
+    loads = [(first_chunk_reserved_gas if chunk == 0 else 0, chunk) for chunk in range(chunk_count)]
+    heapq.heapify(loads)
+    chunks = [[] for _ in range(chunk_count)]
+    for i in order:
+        load, chunk = heapq.heappop(loads)
+        if load + recipient_gas[i] > capacity:
+            return None
+        chunks[chunk].append(i)
+        heapq.heappush(loads, (load + recipient_gas[i], chunk))
+    return chunks
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import pathlib
+from scripts.constants import *
+
+
+# Epoch results are cached on disk as <group>_<epoch>_<sha256 of contents>.csv
+# so re-runs and fork retries never have to hit the coordinape api again.
+# The hash in the file name lets us detect a corrupted or hand edited file.
+class EpochResultsCache:
+    def __init__(self, cache_dir=EPOCH_RESULTS_CACHE_DIR):
+        self.cache_dir = pathlib.Path(cache_dir)
+
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+    def get_paths(self, group, epoch):
+        return sorted(self.cache_dir.glob(f"{group.name}_{epoch}_*.csv"))
+
+
+    def get(self, group, epoch):
+        for path in self.get_paths(group, epoch):
+            text = path.read_text(encoding="utf-8")
+            if path.stem.rsplit("_", 1)[-1] == self.content_hash(text):
+                return text
+            # Contents don't match the hash they were stored under, drop the entry
+            path.unlink()
+        return None
+
+
+    def get_validators_path(self, group, epoch):
+        return self.cache_dir / f"{group.name}_{epoch}.json"
+
+
+    # ETag / Last-Modified the cached results were served with, for conditional requests
+    def get_validators(self, group, epoch):
+        path = self.get_validators_path(group, epoch)
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text(encoding="utf-8"))
+
+
+    def put(self, group, epoch, text, validators=None):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Only one version of an epoch's results is kept around
+        self.invalidate(group, epoch)
+        path = self.cache_dir / f"{group.name}_{epoch}_{self.content_hash(text)}.csv"
+        self.write_atomically(path, text)
+        if validators:
+            self.write_atomically(self.get_validators_path(group, epoch), json.dumps(validators))
+        return path
+
+
+    @staticmethod
+    def write_atomically(path, text):
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        tmp_path.replace(path)
+
+
+    def invalidate(self, group=None, epoch=None):
+        group_pattern = "*" if group is None else group.name
+        epoch_pattern = "*" if epoch is None else epoch
+        removed = 0
+        for path in self.cache_dir.glob(f"{group_pattern}_{epoch_pattern}_*.csv"):
+            path.unlink()
+            removed += 1
+        for path in self.cache_dir.glob(f"{group_pattern}_{epoch_pattern}.json"):
+            path.unlink()
+        return removed
@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scripts.constants import *
+from scripts.configuration import *
+from scripts.epoch_results_cache import EpochResultsCache
+
+
+# Downloads coordinape epoch result csvs over one pooled session, with timeouts and
+# retries with backoff, several group/epochs at a time. Results go through the
+# EpochResultsCache, and cached results are revalidated with conditional requests.
+# endpoint_format can point at a local stand-in for the coordinape api.
+class EpochResultsFetcher:
+    def __init__(
+        self,
+        cache=None,
+        endpoint_format=EPOCH_RESULTS_ENDPOINT_FORMAT,
+        max_workers=EPOCH_RESULTS_MAX_WORKERS,
+        timeout=EPOCH_RESULTS_TIMEOUT,
+        retries=EPOCH_RESULTS_RETRIES,
+        backoff_factor=EPOCH_RESULTS_BACKOFF_FACTOR,
+    ):
+        self.cache = EpochResultsCache() if cache is None else cache
+        self.endpoint_format = endpoint_format
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._session = None
+        self._session_lock = threading.Lock()
+
+
+    # Only set up on the first request, runs that are served from the cache never import requests.
+    # fetch_many's workers can all get here at once, the lock makes sure they share one session.
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                )
+                adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=retry)
+                self._session = requests.Session()
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+            return self._session
+
+
+    # Returns the csv text. Cached results are returned without a request unless
+    # revalidate is set, in which case the server is asked whether they changed.
+    def fetch(self, group, epoch, revalidate=False):
+        cached_text = self.cache.get(group, epoch)
+        if cached_text is not None and not revalidate:
+            return cached_text
+
+        headers = {}
+        if cached_text is not None:
+            validators = self.cache.get_validators(group, epoch)
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last_modified" in validators:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        r = self.session.get(self.endpoint_format.format(group.value, epoch), headers=headers, timeout=self.timeout)
+        if r.status_code == 304 and cached_text is not None:
+            return cached_text
+        r.raise_for_status()
+
+        validators = {}
+        if "ETag" in r.headers:
+            validators["etag"] = r.headers["ETag"]
+        if "Last-Modified" in r.headers:
+            validators["last_modified"] = r.headers["Last-Modified"]
+        self.cache.put(group, epoch, r.text, validators)
+        return r.text
+
+
+    # group_epochs is an iterable of (group, epoch), returns {(group, epoch): csv text}
+    def fetch_many(self, group_epochs, revalidate=False):
+        group_epochs = list(group_epochs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            texts = executor.map(lambda group_epoch: self.fetch(*group_epoch, revalidate=revalidate), group_epochs)
+            return dict(zip(group_epochs, texts))
+
+
+# Every group/epoch we have a reward configured for
+def get_configured_group_epochs():
+    return [(group, epoch) for group, rewards in DEFAULT_USD_REWARD_DICT.items() for epoch in rewards]
+
+
+def fetch_all_epochs(revalidate=False):
+    return EpochResultsFetcher().fetch_many(get_configured_group_epochs(), revalidate)
@@ -0,0 +1,52 @@
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from scripts.constants import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod
+from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+from scripts.contributor_table import ContributorTable
+from scripts.disbursement_index import DisbursementIndex
+from scripts.price_series import PriceSeries
+from scripts.report import make_table
+
+
+# Rebuilds a past epoch's yvYFI report from the disbursement index and the price series,
+# without any RPCs. Run index_disbursements and fill_price_history first.
+def report_epoch(group, epoch):
+    price_series = PriceSeries()
+    disbursement_index = DisbursementIndex(usd_price=price_series.usd_price)
+    payouts = [
+        payout
+        for payout in disbursement_index.get_payouts(group, epoch)
+        if payout[2] == YEARN_VAULT_YFI_ADDRESS.lower()
+    ]
+    assert len(payouts) > 0, f"No indexed yvYFI payouts for {group.name}'s epoch #{epoch}"
+
+    price_point = price_series.for_epoch(disbursement_index, group, epoch)
+    assert price_point is not None, f"No cached prices for {group.name}'s epoch #{epoch}"
+
+    coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, [], ExclusionMethod.REDISTRIBUTE_SHARE)
+    contributors = coordinape_group_epoch.get_contributors_from_epoch()
+    names = []
+    votes = []
+    for _, _, _, recipient, _ in payouts:
+        i = contributors.find(recipient)
+        names.append("unknown" if i is None else contributors.names[i])
+        votes.append(0 if i is None else contributors.votes[i])
+    paid_contributors = ContributorTable(names, [payout[3] for payout in payouts], votes)
+
+    table = make_table(
+        coordinape_group_epoch,
+        paid_contributors,
+        [payout[4] for payout in payouts],
+        10 ** 18,
+        price_point.yfi_in_usd,
+        price_point.price_per_share,
+        paid_contributors.total_votes,
+        "history_{0}_{1}.csv",
+    )
+    print(
+        f"{group.name} epoch #{epoch} as paid in block {price_point.block}\nYFI price ${price_point.yfi_in_usd}\nyvYFI price per share {price_point.price_per_share}\n"
+    )
+    print(table)
+    return table
@@ -0,0 +1,31 @@
+from scripts.constants import *
+
+
+# Batches view calls into Multicall2 aggregate eth_calls, all pinned to the same block,
+# so reading N balances costs ceil(N / chunk_size) RPCs instead of N.
+class Multicall:
+    def __init__(self, contracts, chunk_size=MULTICALL_CHUNK_SIZE):
+        self.contracts = contracts
+        self.chunk_size = chunk_size
+
+
+    # calls is a list of (contract method, args) e.g. (contracts.yvyfi.balanceOf, (address,))
+    def aggregate(self, calls, block=None):
+        if block is None:
+            from brownie import chain
+
+            block = chain.height
+
+        encoded_calls = [(method._address, method.encode_input(*args)) for method, args in calls]
+        return_data = []
+        for start in range(0, len(encoded_calls), self.chunk_size):
+            _, chunk_return_data = self.contracts.multicall.aggregate.call(
+                encoded_calls[start : start + self.chunk_size], block_identifier=block
+            )
+            return_data.extend(chunk_return_data)
+
+        return [method.decode_output(data) for (method, _), data in zip(calls, return_data)]
+
+
+    def balances_of(self, token, holders, block=None):
+        return self.aggregate([(token.balanceOf, (holder,)) for holder in holders], block)
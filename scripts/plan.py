@@ -0,0 +1,103 @@
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from tabulate import tabulate
+from scripts.constants import *
+from scripts.configuration import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
+from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+from scripts.disbursement_index import load_disbursement_index
+from scripts.chain_snapshot import ChainSnapshot
+from scripts.disbursement import Disbursement
+from scripts.report import make_table
+from scripts.safe_tx import build_safe_txs, save_safe_txs
+
+
+def describe_arg(arg):
+    if isinstance(arg, (list, tuple)):
+        return f"[{len(arg)} items]"
+    return str(arg)
+
+
+def make_plan_table(planned_txs):
+    return tabulate(
+        [
+            [i, f"{planned_tx.contract}.{planned_tx.method}", ", ".join(describe_arg(arg) for arg in planned_tx.args)]
+            for i, planned_tx in enumerate(planned_txs)
+        ],
+        headers=["#", "Call", "Args"],
+        tablefmt="orgtbl",
+    )
+
+
+# Funding, amounts and disperse simulated against an offline snapshot, which is updated as it goes
+def simulate_disbursement(coordinape_group_epoch, reward_in_usd, funding_method, snapshot, swap_quoter=None):
+    disbursement = Disbursement(reward_in_usd, funding_method, None, EXPECTED_YVYFI_BUFFER, snapshot, swap_quoter)
+    disbursement.get_amounts(coordinape_group_epoch)
+    disbursement.prep_reward()
+    disbursement.disperse_reward(disbursement.contributors.addresses)
+    disbursement.check_asserts()
+    return disbursement
+
+
+# Runs the funding and disperse logic against a saved state snapshot instead of a fork.
+# Everything is simulated in python, so this is a quick preview of the amounts, the
+# transactions the safe would send and the report. Only the final run needs a fork.
+# With safe_nonce set, the multisend and its safe tx hash are written to safe_tx_<group>_<epoch>.json.
+def plan(
+    group,
+    epoch,
+    state_path,
+    funding_method=FundingMethod.DEPOSIT_YFI,
+    exclusion_list=[],
+    exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE,
+    safe_nonce=None,
+    safe_version=SAFE_VERSION,
+    chain_id=1,
+):
+    coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, exclusion_list, exclusion_type)
+    reward_in_usd = coordinape_group_epoch.get_reward_in_usd(load_disbursement_index())
+    assert (
+        len(coordinape_group_epoch.get_rewarded_contributors_this_epoch()) > 0
+    ), f"{group.name}'s epoch #{epoch} does not have any contributors with votes received..."
+
+    snapshot = ChainSnapshot.load(state_path)
+    disbursement = simulate_disbursement(coordinape_group_epoch, reward_in_usd, funding_method, snapshot)
+    amounts = disbursement.amounts
+
+    table = make_table(
+        coordinape_group_epoch,
+        disbursement.contributors,
+        amounts,
+        snapshot.yfi_decimal_multiplicand,
+        disbursement.yfi_in_usd,
+        snapshot.price_per_share,
+        coordinape_group_epoch.get_total_votes(),
+        "plan_{0}_{1}.csv",
+    )
+
+    print(
+        f"{group.name} epoch #{epoch} plan ({funding_method.name}) from block {snapshot.block}\nDistributing ${reward_in_usd}\nYFI price ${disbursement.yfi_in_usd}\nyvYFI price per share {snapshot.price_per_share}\n"
+    )
+    print(make_plan_table(disbursement.planned_txs))
+    print(
+        f"{len(disbursement.safe_tx_starts)} safe transaction(s), estimated gas {', '.join(str(chunk.gas) for chunk in disbursement.disperse_chunks)}"
+    )
+    print()
+    print(table)
+
+    if safe_nonce is not None:
+        safe_txs = build_safe_txs(disbursement.get_safe_tx_groups(), snapshot.safe_address, safe_nonce, chain_id, safe_version)
+        save_safe_txs(safe_txs, SAFE_TX_OUTPUT_FORMAT.format(group.name, epoch))
+        print()
+        for safe_tx in safe_txs:
+            print(f"Safe tx hash {safe_tx.safe_tx_hash} (nonce {safe_tx.nonce}, {len(safe_tx.data) // 2 - 1} bytes of calldata)")
+    return disbursement
+
+
+# Saves the state a plan needs from the current network, e.g. a mainnet-fork:
+# brownie run plan.py save_state ychad.eth state.json
+def save_state(safe_name, state_path):
+    from scripts.contracts import Contracts
+
+    ChainSnapshot(Contracts(safe_name)).save(state_path)
@@ -0,0 +1,167 @@
+import pathlib
+import sqlite3
+from collections import namedtuple
+from scripts.constants import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    block INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    yfi_usd_answer TEXT NOT NULL,
+    yfi_usd_decimals INTEGER NOT NULL,
+    yvyfi_price_per_share TEXT NOT NULL,
+    yvyfi_total_assets TEXT NOT NULL,
+    yvyfi_total_supply TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prices_timestamp ON prices (timestamp);
+"""
+
+PRICE_FIELDS = [
+    "block",
+    "timestamp",
+    "yfi_usd_answer",
+    "yfi_usd_decimals",
+    "yvyfi_price_per_share",
+    "yvyfi_total_assets",
+    "yvyfi_total_supply",
+]
+
+
+class PricePoint(namedtuple("PricePoint", PRICE_FIELDS)):
+    @property
+    def yfi_in_usd(self):
+        return self.yfi_usd_answer / 10 ** self.yfi_usd_decimals
+
+
+    # yvYFI has 18 decimals, like YFI
+    @property
+    def price_per_share(self):
+        return self.yvyfi_price_per_share / 10 ** 18
+
+
+    @property
+    def yvyfi_ratio(self):
+        return self.yvyfi_total_assets / self.yvyfi_total_supply
+
+
+    @property
+    def yvyfi_in_usd(self):
+        return self.yfi_in_usd * self.price_per_share
+
+
+# Local time series of the YFI/USD oracle answer and yvYFI pricePerShare/totalAssets/totalSupply
+# keyed by block and timestamp. Filling it takes one archive multicall per block, after
+# that historical reports and reconciliations read from here without any RPCs.
+class PriceSeries:
+    def __init__(self, path=PRICE_SERIES_PATH):
+        if path != ":memory:":
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+
+    def has_block(self, block):
+        return self.db.execute("SELECT 1 FROM prices WHERE block = ?", (block,)).fetchone() is not None
+
+
+    def put(self, price_point):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [int(value) if i < 2 or PRICE_FIELDS[i] == "yfi_usd_decimals" else str(int(value)) for i, value in enumerate(price_point)],
+            )
+
+
+    @staticmethod
+    def to_price_point(row):
+        return PricePoint(*(int(value) for value in row))
+
+
+    def fill(self, contracts, blocks):
+        from scripts.multicall import Multicall
+
+        multicall = Multicall(contracts)
+        calls = [
+            (contracts.multicall.getCurrentBlockTimestamp, ()),
+            (contracts.yfi_usd_oracle.latestAnswer, ()),
+            (contracts.yfi_usd_oracle.decimals, ()),
+            (contracts.yvyfi.pricePerShare, ()),
+            (contracts.yvyfi.totalAssets, ()),
+            (contracts.yvyfi.totalSupply, ()),
+        ]
+        filled = 0
+        for block in blocks:
+            if self.has_block(block):
+                continue
+            self.put(PricePoint(block, *multicall.aggregate(calls, block)))
+            filled += 1
+        return filled
+
+
+    def fill_range(self, contracts, from_block, to_block, step=PRICE_SERIES_BLOCK_STEP):
+        blocks = list(range(from_block, to_block + 1, step))
+        if blocks[-1] != to_block:
+            blocks.append(to_block)
+        return self.fill(contracts, blocks)
+
+
+    # The point for exactly this block, None if it wasn't filled
+    def get(self, block):
+        row = self.db.execute(f"SELECT {', '.join(PRICE_FIELDS)} FROM prices WHERE block = ?", (block,)).fetchone()
+        return None if row is None else self.to_price_point(row)
+
+
+    # Latest point at or before block
+    def at_block(self, block):
+        row = self.db.execute(
+            f"SELECT {', '.join(PRICE_FIELDS)} FROM prices WHERE block <= ? ORDER BY block DESC LIMIT 1", (block,)
+        ).fetchone()
+        return None if row is None else self.to_price_point(row)
+
+
+    # Latest point at or before timestamp
+    def at_timestamp(self, timestamp):
+        row = self.db.execute(
+            f"SELECT {', '.join(PRICE_FIELDS)} FROM prices WHERE timestamp <= ? ORDER BY timestamp DESC LIMIT 1", (timestamp,)
+        ).fetchone()
+        return None if row is None else self.to_price_point(row)
+
+
+    def between(self, from_block, to_block):
+        return [
+            self.to_price_point(row)
+            for row in self.db.execute(
+                f"SELECT {', '.join(PRICE_FIELDS)} FROM prices WHERE block BETWEEN ? AND ? ORDER BY block", (from_block, to_block)
+            )
+        ]
+
+
+    # Price at the block an epoch was dispersed in, from the disbursement index
+    def for_epoch(self, disbursement_index, group, epoch):
+        disperses = disbursement_index.get_epoch_disperses(group, epoch)
+        if len(disperses) == 0:
+            return None
+        return self.get(disperses[0][1])
+
+
+    # usd_price for DisbursementIndex. Only a price from the disperse's own block is used, an
+    # older point would add the price drift since then to the leftover carried into the next epoch.
+    def usd_price(self, token, block):
+        price_point = self.get(block) if token.lower() == YEARN_VAULT_YFI_ADDRESS.lower() else None
+        return None if price_point is None else price_point.yvyfi_in_usd
+
+
+# Fills the series up to the current block, plus every block with an indexed disperse so
+# payouts are priced at their own block. Needs an archive node:
+# brownie run price_series.py fill_price_history ychad.eth
+def fill_price_history(safe_name=YCHAD_ETH, from_block=DISBURSEMENT_INDEX_START_BLOCK):
+    from brownie import chain
+    from scripts.contracts import Contracts
+    from scripts.disbursement_index import DisbursementIndex
+
+    price_series = PriceSeries()
+    contracts = Contracts(safe_name)
+    filled = price_series.fill_range(contracts, from_block, chain.height)
+    filled += price_series.fill(contracts, DisbursementIndex().get_disperse_blocks())
+    print(f"Added {filled} price points")
+    return price_series
@@ -0,0 +1,120 @@
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from tabulate import tabulate
+
+
+# Times the phases of a run and, once installed, counts every RPC the run makes
+# through a web3 middleware, grouped by phase and RPC method. Transactions sent
+# through Disbursement.execute are recorded with their latency and gas used.
+class Profiler:
+    def __init__(self):
+        self.current_phase = "setup"
+        self.phase_seconds = defaultdict(float)
+        self.rpc_counts = defaultdict(Counter)
+        self.rpc_seconds = defaultdict(float)
+        self.calls = []
+        self.installed = False
+
+
+    @contextmanager
+    def phase(self, name):
+        previous_phase = self.current_phase
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start
+            self.current_phase = previous_phase
+
+
+    def record_rpc(self, method, seconds):
+        self.rpc_counts[self.current_phase][method] += 1
+        self.rpc_seconds[self.current_phase] += seconds
+
+
+    def record_call(self, name, seconds, gas_used=None):
+        self.calls.append(
+            {"phase": self.current_phase, "name": name, "seconds": seconds, "gas_used": gas_used}
+        )
+
+
+    def rpc_middleware(self, make_request, w3):
+        def middleware(method, params):
+            start = time.perf_counter()
+            try:
+                return make_request(method, params)
+            finally:
+                self.record_rpc(method, time.perf_counter() - start)
+
+        return middleware
+
+
+    def install(self):
+        from brownie import web3
+
+        if not self.installed:
+            web3.middleware_onion.add(self.rpc_middleware, name="profiler")
+            self.installed = True
+
+
+    def uninstall(self):
+        from brownie import web3
+
+        if self.installed:
+            web3.middleware_onion.remove("profiler")
+            self.installed = False
+
+
+    def get_phase_names(self):
+        names = list(self.phase_seconds)
+        for name in list(self.rpc_counts) + [call["phase"] for call in self.calls]:
+            if name not in names:
+                names.append(name)
+        return names
+
+
+    def report(self):
+        phases = {}
+        for name in self.get_phase_names():
+            phase_calls = [call for call in self.calls if call["phase"] == name]
+            phases[name] = {
+                "seconds": self.phase_seconds.get(name, 0.0),
+                "rpc_calls": dict(self.rpc_counts.get(name, {})),
+                "rpc_seconds": self.rpc_seconds.get(name, 0.0),
+                "transactions": len(phase_calls),
+                "gas_used": sum(call["gas_used"] or 0 for call in phase_calls),
+            }
+        return {
+            "phases": phases,
+            "calls": self.calls,
+            "total_rpc_calls": sum(sum(counts.values()) for counts in self.rpc_counts.values()),
+            "total_gas_used": sum(call["gas_used"] or 0 for call in self.calls),
+        }
+
+
+    def make_summary_table(self):
+        rows = [
+            [
+                name,
+                "{:0.3f}".format(phase["seconds"]),
+                sum(phase["rpc_calls"].values()),
+                "{:0.3f}".format(phase["rpc_seconds"]),
+                ", ".join(f"{method}: {count}" for method, count in sorted(phase["rpc_calls"].items())),
+                phase["gas_used"],
+            ]
+            for name, phase in self.report()["phases"].items()
+        ]
+        return tabulate(
+            rows,
+            headers=["Phase", "Seconds", "RPCs", "RPC seconds", "RPCs by method", "Gas used"],
+            tablefmt="orgtbl",
+        )
+
+
+    def write_report(self, path):
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        print(self.make_summary_table())
@@ -0,0 +1,125 @@
+import csv
+import heapq
+import json
+import os
+import pathlib
+import tempfile
+from tabulate import tabulate
+from scripts.constants import *
+
+REPORT_HEADERS = ["Name", "Address", "Received Votes", "Amount yvYFI", "Amount USD"]
+
+
+# The mode open() would give a new file, os.umask can only be read by setting it
+def get_default_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Writes to a temp file next to path and moves it into place on commit, so a crashed
+# run never leaves a half written report behind. mkstemp creates the temp file
+# readable by the owner only, so it gets the usual permissions before the move.
+class AtomicFile:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        self.file = os.fdopen(fd, "w", newline="")
+
+
+    def commit(self):
+        self.file.close()
+        os.chmod(self.tmp_path, get_default_file_mode())
+        os.replace(self.tmp_path, self.path)
+
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+# Streams report rows once into the csv, a json lines file and the console table.
+# Totals are kept as rows go by and the console only shows the top console_top_n
+# rows by amount (all rows, in order, when there are fewer than that) plus the total.
+class ReportWriter:
+    def __init__(self, csv_path=None, jsonl_path=None, yfi_decimal_multiplicand=10 ** 18, yfi_in_usd=0, price_per_share=1, console_top_n=REPORT_CONSOLE_TOP_N):
+        self.csv_file = AtomicFile(csv_path) if csv_path is not None else None
+        self.csv_writer = csv.writer(self.csv_file.file, dialect="excel") if self.csv_file is not None else None
+        self.jsonl_file = AtomicFile(jsonl_path) if jsonl_path is not None else None
+        self.yfi_decimal_multiplicand = yfi_decimal_multiplicand
+        self.usd_per_yvyfi = yfi_in_usd * price_per_share
+        self.console_top_n = console_top_n
+        self.top_rows = []
+        self.row_count = 0
+        self.total_votes = 0
+        self.total_amount = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for atomic_file in (self.csv_file, self.jsonl_file):
+            if atomic_file is None:
+                continue
+            if exc_type is None:
+                atomic_file.commit()
+            else:
+                atomic_file.discard()
+
+
+    def make_row(self, name, address, votes, amount):
+        yvyfi_amount = amount / self.yfi_decimal_multiplicand
+        return [name, address, votes, yvyfi_amount, "${:0.2f}".format(yvyfi_amount * self.usd_per_yvyfi)]
+
+
+    # jsonl_row defaults to row, the json lines file gets full addresses to reconcile against payouts
+    def emit(self, row, jsonl_row=None):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(row)
+        if self.jsonl_file is not None:
+            self.jsonl_file.file.write(json.dumps(dict(zip(REPORT_HEADERS, row if jsonl_row is None else jsonl_row))) + "\n")
+
+
+    def write_row(self, name, address, votes, amount):
+        jsonl_row = self.make_row(name, address, votes, amount)
+        row = [name, address[:6]] + jsonl_row[2:]
+        self.emit(row, jsonl_row)
+
+        entry = (amount, -self.row_count, row)
+        if len(self.top_rows) < self.console_top_n:
+            heapq.heappush(self.top_rows, entry)
+        elif self.console_top_n > 0:
+            heapq.heappushpop(self.top_rows, entry)
+
+        self.row_count += 1
+        self.total_votes += votes
+        self.total_amount += amount
+
+
+    # Writes the total row and returns the console table
+    def finish(self, total_votes=None):
+        total_row = self.make_row(
+            "TOTAL", "------", self.total_votes if total_votes is None else total_votes, self.total_amount
+        )
+        self.emit(total_row)
+
+        if self.row_count <= self.console_top_n:
+            console_rows = [row for _, _, row in sorted(self.top_rows, key=lambda entry: -entry[1])]
+        else:
+            console_rows = [row for _, _, row in sorted(self.top_rows, reverse=True)]
+            console_rows.append([f"... {self.row_count - len(console_rows)} more", "", "", "", ""])
+        console_rows.append(total_row)
+
+        return tabulate(console_rows, headers=REPORT_HEADERS, tablefmt="orgtbl")
+
+
+def make_table(coordinape_group_epoch, contributors_this_epoch, amounts, yfi_decimal_multiplicand, yfi_in_usd, price_per_share, total_votes, output_format="output_{0}_{1}.csv", console_top_n=REPORT_CONSOLE_TOP_N):
+    csv_path = pathlib.Path(output_format.format(coordinape_group_epoch.group, coordinape_group_epoch.epoch))
+    with ReportWriter(csv_path, csv_path.with_suffix(".jsonl"), yfi_decimal_multiplicand, yfi_in_usd, price_per_share, console_top_n) as writer:
+        for (name, address, votes), amount in zip(contributors_this_epoch.rows(), amounts):
+            writer.write_row(name, address, votes, amount)
+        return writer.finish(total_votes)
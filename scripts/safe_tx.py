@@ -0,0 +1,168 @@
+import json
+from collections import namedtuple
+from scripts.constants import *
+from scripts.contracts import CONTRACT_ADDRESSES
+
+# Signatures of every call a Disbursement plans, by method name
+FUNCTION_SIGNATURES = {
+    "approve": "approve(address,uint256)",
+    "toGovernance": "toGovernance(address,uint256)",
+    "deposit": "deposit(uint256)",
+    "setDepositLimit": "setDepositLimit(uint256)",
+    "swapExactTokensForTokens": "swapExactTokensForTokens(uint256,uint256,address[],address,uint256)",
+    "disperseToken": "disperseToken(address,address[],uint256[])",
+}
+
+MULTISEND_SIGNATURE = "multiSend(bytes)"
+SAFE_TX_TYPE = "SafeTx(address to,uint256 value,bytes data,uint8 operation,uint256 safeTxGas,uint256 baseGas,uint256 gasPrice,address gasToken,address refundReceiver,uint256 nonce)"
+DOMAIN_TYPE = "EIP712Domain(address verifyingContract)"
+DOMAIN_WITH_CHAIN_ID_TYPE = "EIP712Domain(uint256 chainId,address verifyingContract)"
+
+CALL = 0
+DELEGATECALL = 1
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+SafeTx = namedtuple(
+    "SafeTx",
+    ["safe_address", "chain_id", "version", "to", "value", "data", "operation", "safe_tx_gas", "base_gas", "gas_price", "gas_token", "refund_receiver", "nonce", "safe_tx_hash"],
+)
+
+
+# eth_abi is only needed here and is slow to import, so offline commands that
+# don't build a safe transaction don't pay for it
+def encode_abi(types, args):
+    try:
+        from eth_abi import encode_abi
+    except ImportError:
+        # eth_abi 4+ renamed it
+        from eth_abi import encode as encode_abi
+    return encode_abi(types, args)
+
+
+def keccak(data=None, text=None):
+    from eth_utils import keccak
+
+    return keccak(data) if text is None else keccak(text=text)
+
+
+def get_argument_types(signature):
+    arguments = signature[signature.index("(") + 1 : -1]
+    return arguments.split(",") if arguments else []
+
+
+def encode_call(signature, args):
+    return keccak(text=signature)[:4] + encode_abi(get_argument_types(signature), list(args))
+
+
+# Amounts have to be ints by the time they're planned, eth_abi won't encode a float
+# like 75000000000.0 even when it's a whole number
+def check_planned_tx_args(planned_tx):
+    for arg in planned_tx.args:
+        values = arg if isinstance(arg, (list, tuple)) else [arg]
+        for value in values:
+            assert not isinstance(value, float), f"{planned_tx.contract}.{planned_tx.method} got {value!r}, amounts must be ints"
+
+
+# Calldata for a PlannedTx, straight from its method and arguments
+def encode_planned_tx(planned_tx):
+    assert planned_tx.method in FUNCTION_SIGNATURES, f"No signature for {planned_tx.contract}.{planned_tx.method}"
+    check_planned_tx_args(planned_tx)
+    args = [list(arg) if isinstance(arg, (list, tuple)) else arg for arg in planned_tx.args]
+    return encode_call(FUNCTION_SIGNATURES[planned_tx.method], args)
+
+
+def get_planned_tx_address(planned_tx):
+    address = CONTRACT_ADDRESSES[planned_tx.contract]
+    assert not address.endswith(".eth"), f"{planned_tx.contract} is an ens name, it needs to be resolved on chain"
+    return address
+
+
+# MultiSend packs each call as operation (1 byte), to (20 bytes), value (32 bytes),
+# data length (32 bytes) and data, one after the other
+def encode_multisend(planned_txs):
+    transactions = b""
+    for planned_tx in planned_txs:
+        data = encode_planned_tx(planned_tx)
+        transactions += (
+            CALL.to_bytes(1, "big")
+            + bytes.fromhex(get_planned_tx_address(planned_tx)[2:])
+            + (0).to_bytes(32, "big")
+            + len(data).to_bytes(32, "big")
+            + data
+        )
+    return encode_call(MULTISEND_SIGNATURE, [transactions])
+
+
+def parse_version(version):
+    return tuple(int(part) for part in version.split("+")[0].split("."))
+
+
+# EIP-712 hash the owners sign. Safes before v1.3.0 leave the chain id out of the domain.
+def get_safe_tx_hash(safe_address, chain_id, version, to, value, data, operation, safe_tx_gas, base_gas, gas_price, gas_token, refund_receiver, nonce):
+    if parse_version(version) >= (1, 3, 0):
+        domain_separator = keccak(encode_abi(["bytes32", "uint256", "address"], [keccak(text=DOMAIN_WITH_CHAIN_ID_TYPE), chain_id, safe_address]))
+    else:
+        domain_separator = keccak(encode_abi(["bytes32", "address"], [keccak(text=DOMAIN_TYPE), safe_address]))
+
+    struct_hash = keccak(
+        encode_abi(
+            ["bytes32", "address", "uint256", "bytes32", "uint8", "uint256", "uint256", "uint256", "address", "address", "uint256"],
+            [keccak(text=SAFE_TX_TYPE), to, value, keccak(data), operation, safe_tx_gas, base_gas, gas_price, gas_token, refund_receiver, nonce],
+        )
+    )
+    return "0x" + keccak(b"\x19\x01" + domain_separator + struct_hash).hex().replace("0x", "")
+
+
+# Builds the multisend the safe would post for these planned transactions without running
+# them anywhere. The safe delegatecalls MultiSend, so every call is sent from the safe.
+def build_safe_tx(planned_txs, safe_address, nonce, chain_id=1, version=SAFE_VERSION):
+    data = encode_multisend(planned_txs)
+    fields = dict(
+        safe_address=safe_address,
+        chain_id=chain_id,
+        version=version,
+        to=MULTISEND_ADDRESS,
+        value=0,
+        data="0x" + data.hex(),
+        operation=DELEGATECALL,
+        safe_tx_gas=0,
+        base_gas=0,
+        gas_price=0,
+        gas_token=ZERO_ADDRESS,
+        refund_receiver=ZERO_ADDRESS,
+        nonce=nonce,
+    )
+    safe_tx_hash = get_safe_tx_hash(**dict(fields, data=data))
+    return SafeTx(safe_tx_hash=safe_tx_hash, **fields)
+
+
+# One safe transaction per group of planned transactions, see Disbursement.get_safe_tx_groups.
+# They get consecutive nonces so the owners can sign them all in one round.
+def build_safe_txs(planned_tx_groups, safe_address, nonce, chain_id=1, version=SAFE_VERSION):
+    return [
+        build_safe_tx(planned_txs, safe_address, nonce + i, chain_id, version)
+        for i, planned_txs in enumerate(planned_tx_groups)
+    ]
+
+
+def save_safe_txs(safe_txs, path):
+    with open(path, "w") as safe_tx_file:
+        json.dump([safe_tx._asdict() for safe_tx in safe_txs], safe_tx_file, indent=2)
+
+
+# The same transaction as an ape_safe SafeTx, for preview() and post_transaction()
+def to_ape_safe_tx(safe, safe_tx):
+    ape_safe_tx = safe.build_multisig_tx(
+        safe_tx.to,
+        safe_tx.value,
+        bytes.fromhex(safe_tx.data[2:]),
+        safe_tx.operation,
+        safe_tx.safe_tx_gas,
+        safe_tx.base_gas,
+        safe_tx.gas_price,
+        safe_tx.gas_token,
+        safe_tx.refund_receiver,
+        safe_nonce=safe_tx.nonce,
+    )
+    assert "0x" + bytes(ape_safe_tx.safe_tx_hash).hex().replace("0x", "") == safe_tx.safe_tx_hash.lower(), "ape_safe computed a different safe tx hash"
+    return ape_safe_tx
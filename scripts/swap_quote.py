@@ -0,0 +1,157 @@
+from collections import namedtuple
+from scripts.constants import *
+
+PAIR_ABI = [
+    {
+        "name": "getReserves",
+        "type": "function",
+        "stateMutability": "view",
+        "inputs": [],
+        "outputs": [
+            {"name": "_reserve0", "type": "uint112"},
+            {"name": "_reserve1", "type": "uint112"},
+            {"name": "_blockTimestampLast", "type": "uint32"},
+        ],
+    },
+    {
+        "name": "token0",
+        "type": "function",
+        "stateMutability": "view",
+        "inputs": [],
+        "outputs": [{"name": "", "type": "address"}],
+    },
+]
+
+# One swapExactTokensForTokens call: path, amount in, expected amount out and the minimum out we accept
+SwapLeg = namedtuple("SwapLeg", ["path", "amount_in", "amount_out", "amount_out_min"])
+SwapQuote = namedtuple("SwapQuote", ["legs", "amount_out"])
+
+
+# Constant product output of one hop after the 0.3% fee, exact for ints
+def get_amount_out(amount_in, reserve_in, reserve_out):
+    amount_in_with_fee = amount_in * 997
+    return amount_in_with_fee * reserve_out // (reserve_in * 1000 + amount_in_with_fee)
+
+
+# Same as get_amount_out over a numpy array of amounts, in floats
+def get_amounts_out(amounts_in, reserve_in, reserve_out):
+    amounts_in_with_fee = amounts_in * 997.0
+    return amounts_in_with_fee * float(reserve_out) / (float(reserve_in) * 1000.0 + amounts_in_with_fee)
+
+
+def get_pairs(path):
+    return list(zip(path[:-1], path[1:]))
+
+
+# Quotes sushiswap trades locally. Pair reserves for every candidate route are read in one
+# batched multicall, then single routes and splits between routes are priced in python/numpy
+# without an eth_call per candidate, and the best one is turned into swap legs with a real minimum out.
+class SwapQuoter:
+    def __init__(self, contracts, routes=SWAP_ROUTES, slippage=SWAP_SLIPPAGE, split_steps=SWAP_SPLIT_STEPS):
+        self.contracts = contracts
+        self.routes = [[token.lower() for token in route] for route in routes]
+        self.slippage = slippage
+        self.split_steps = split_steps
+        self.reserves = {}
+
+
+    # Pair addresses never change, so they're kept in the contract cache after the first lookup.
+    # Pairs that don't exist (yet) come back as the zero address and aren't cached.
+    def get_pair_addresses(self, pairs):
+        from scripts.multicall import Multicall
+
+        cache = self.contracts.cache
+        chain_id = self.contracts.chain_id
+        pair_addresses = {pair: cache.get_immutable(chain_id, SUSHISWAP_FACTORY_ADDRESS, f"pair:{pair[0]}:{pair[1]}") for pair in pairs}
+        missing = [pair for pair, address in pair_addresses.items() if address is None]
+        if missing:
+            factory = self.contracts.sushiswap_factory
+            addresses = Multicall(self.contracts).aggregate([(factory.getPair, pair) for pair in missing])
+            for pair, address in zip(missing, addresses):
+                if int(str(address), 16) != 0:
+                    cache.put_immutable(chain_id, SUSHISWAP_FACTORY_ADDRESS, f"pair:{pair[0]}:{pair[1]}", str(address))
+                pair_addresses[pair] = str(address)
+        return pair_addresses
+
+
+    # Routes through a pair that doesn't exist are dropped
+    def load_reserves(self, block=None):
+        from brownie import Contract
+        from scripts.multicall import Multicall
+
+        pairs = list(dict.fromkeys(pair for route in self.routes for pair in get_pairs(route)))
+        pair_addresses = self.get_pair_addresses(pairs)
+        missing_pairs = {pair for pair in pairs if int(pair_addresses[pair], 16) == 0}
+        self.routes = [route for route in self.routes if not set(get_pairs(route)) & missing_pairs]
+        assert len(self.routes) > 0, "None of the swap routes have sushiswap pairs"
+        pairs = [pair for pair in pairs if pair not in missing_pairs]
+        pair_contracts = [Contract.from_abi("UniswapV2Pair", pair_addresses[pair], PAIR_ABI) for pair in pairs]
+        calls = []
+        for pair_contract in pair_contracts:
+            calls.append((pair_contract.getReserves, ()))
+            calls.append((pair_contract.token0, ()))
+        results = Multicall(self.contracts).aggregate(calls, block)
+
+        for i, (token_in, token_out) in enumerate(pairs):
+            reserve0, reserve1, _ = results[2 * i]
+            token0 = str(results[2 * i + 1]).lower()
+            reserves = (int(reserve0), int(reserve1)) if token0 == token_in else (int(reserve1), int(reserve0))
+            self.reserves[(token_in, token_out)] = reserves
+            self.reserves[(token_out, token_in)] = reserves[::-1]
+        return self.reserves
+
+
+    def get_route_amount_out(self, route, amount_in):
+        for pair in get_pairs(route):
+            amount_in = get_amount_out(amount_in, *self.reserves[pair])
+        return amount_in
+
+
+    def get_route_amounts_out(self, route, amounts_in):
+        for pair in get_pairs(route):
+            amounts_in = get_amounts_out(amounts_in, *self.reserves[pair])
+        return amounts_in
+
+
+    def make_leg(self, route, amount_in):
+        amount_out = self.get_route_amount_out(route, amount_in)
+        return SwapLeg(route, amount_in, amount_out, int(amount_out * (1 - self.slippage)))
+
+
+    # Splitting only works out if the routes don't trade through the same pools
+    def get_split_candidates(self):
+        candidates = []
+        for i, route_a in enumerate(self.routes):
+            for route_b in self.routes[i + 1 :]:
+                if not set(get_pairs(route_a)) & set(get_pairs(route_b)):
+                    candidates.append((route_a, route_b))
+        return candidates
+
+
+    def quote(self, amount_in, block=None):
+        import numpy as np
+
+        if not self.reserves:
+            self.load_reserves(block)
+        amount_in = int(amount_in)
+
+        best_legs = None
+        best_amount_out = -1
+        for route in self.routes:
+            amount_out = self.get_route_amount_out(route, amount_in)
+            if amount_out > best_amount_out:
+                best_legs, best_amount_out = [(route, amount_in)], amount_out
+
+        fractions = np.linspace(0.0, 1.0, self.split_steps + 1)[1:-1]
+        for route_a, route_b in self.get_split_candidates():
+            amounts_a = fractions * amount_in
+            amounts_out = self.get_route_amounts_out(route_a, amounts_a) + self.get_route_amounts_out(route_b, amount_in - amounts_a)
+            best = int(np.argmax(amounts_out))
+            # The float scan picks the split, the exact amounts are recomputed in ints
+            amount_in_a = int(fractions[best] * amount_in)
+            amount_out = self.get_route_amount_out(route_a, amount_in_a) + self.get_route_amount_out(route_b, amount_in - amount_in_a)
+            if amount_out > best_amount_out:
+                best_legs, best_amount_out = [(route_a, amount_in_a), (route_b, amount_in - amount_in_a)], amount_out
+
+        legs = [self.make_leg(route, leg_amount_in) for route, leg_amount_in in best_legs]
+        return SwapQuote(legs, sum(leg.amount_out for leg in legs))
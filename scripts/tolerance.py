@@ -0,0 +1,3 @@
+# Same check as pytest.approx(expected, rel_tolerance), without importing pytest at runtime
+def is_close(actual, expected, rel_tolerance=1e-6, abs_tolerance=1e-12):
+    return abs(actual - expected) <= max(rel_tolerance * abs(expected), abs_tolerance)
@@ -0,0 +1,93 @@
+import copy
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute()))
+from brownie import chain, history
+from tabulate import tabulate
+from scripts.constants import *
+from scripts.configuration import *
+from scripts.coordinape_enums import CoordinapeGroup, ExclusionMethod, FundingMethod
+from scripts.coordinape_group_epoch import CoordinapeGroupEpoch
+from scripts.disbursement_index import load_disbursement_index
+from scripts.chain_snapshot import ChainSnapshot
+from scripts.contracts import Contracts
+from scripts.disbursement import Disbursement
+
+BALANCE_FIELDS = ["safe_yfi", "safe_yvyfi", "safe_usdc", "treasury_yfi", "treasury_yvyfi", "treasury_usdc"]
+
+
+def run_candidate(contracts, coordinape_group_epoch, reward_in_usd, funding_method, initial_snapshot):
+    result = {"funding_method": funding_method, "passed": False, "error": None, "buffer": None}
+    history_length = len(history)
+    disbursement = Disbursement(reward_in_usd, funding_method, contracts, EXPECTED_YVYFI_BUFFER, copy.copy(initial_snapshot))
+    try:
+        disbursement.get_amounts(coordinape_group_epoch)
+        disbursement.prep_reward()
+        result["buffer"] = (disbursement.snapshot.safe_yvyfi - disbursement.yvyfi_to_disperse) / disbursement.yvyfi_to_disperse
+        disbursement.disperse_reward(disbursement.contributors.addresses)
+        disbursement.check_asserts()
+        result["passed"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}".splitlines()[0]
+        disbursement.snapshot.refresh()
+
+    result["gas_used"] = sum(tx.gas_used for tx in history[history_length:])
+    result["deltas"] = {
+        field: getattr(disbursement.snapshot, field) - getattr(initial_snapshot, field) for field in BALANCE_FIELDS
+    }
+    return result
+
+
+def make_what_if_table(results, yfi_decimal_multiplicand, usdc_decimal_multiplicand):
+    rows = []
+    for result in results:
+        deltas = result["deltas"]
+        rows.append(
+            [
+                result["funding_method"].name,
+                "pass" if result["passed"] else "fail",
+                result["gas_used"],
+                "" if result["buffer"] is None else "{:0.2%}".format(result["buffer"]),
+                deltas["safe_yfi"] / yfi_decimal_multiplicand,
+                deltas["safe_yvyfi"] / yfi_decimal_multiplicand,
+                deltas["treasury_yfi"] / yfi_decimal_multiplicand,
+                deltas["treasury_yvyfi"] / yfi_decimal_multiplicand,
+                (deltas["safe_usdc"] + deltas["treasury_usdc"]) / usdc_decimal_multiplicand,
+                result["error"] or "",
+            ]
+        )
+    return tabulate(
+        rows,
+        headers=["Funding", "check_asserts", "Gas", "Buffer", "Safe YFI", "Safe yvYFI", "Treasury YFI", "Treasury yvYFI", "USDC", "Error"],
+        tablefmt="orgtbl",
+    )
+
+
+# Tries every funding method for an epoch on one fork: the chain state is snapshotted
+# once, each candidate runs prep_reward and the disperse, and the chain is reverted in between.
+# brownie run what_if.py evaluate_funding_methods
+def evaluate_funding_methods(
+    group=CoordinapeGroup.COMMUNITY,
+    epoch=9,
+    safe_name=YCHAD_ETH,
+    funding_methods=list(FundingMethod),
+    exclusion_list=[],
+    exclusion_type=ExclusionMethod.REDISTRIBUTE_SHARE,
+):
+    coordinape_group_epoch = CoordinapeGroupEpoch(group, epoch, exclusion_list, exclusion_type)
+    reward_in_usd = coordinape_group_epoch.get_reward_in_usd(load_disbursement_index())
+    contracts = Contracts(safe_name)
+    initial_snapshot = ChainSnapshot(contracts)
+
+    chain.snapshot()
+    results = []
+    try:
+        for funding_method in funding_methods:
+            results.append(run_candidate(contracts, coordinape_group_epoch, reward_in_usd, funding_method, initial_snapshot))
+            chain.revert()
+    finally:
+        chain.revert()
+
+    print(f"{group.name} epoch #{epoch}, ${reward_in_usd} from {safe_name} at block {initial_snapshot.block}\n")
+    print(make_what_if_table(results, initial_snapshot.yfi_decimal_multiplicand, initial_snapshot.usdc_decimal_multiplicand))
+    return results